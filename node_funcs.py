@@ -81,6 +81,9 @@ functions = (update_driver, get_saved_log_level, save_log_level, set_logging_lev
          'default': default value of parameter,
          'notice': 'string to send notice if not set',
          'isRequired: True/False,
+         'type': optional, function to convert the value (int, float,
+                 boolean, ...)
+         'choices': optional, list of allowed (lower case) values
         },
         {'name': name of parameter,
          'default': default value of parameter,
@@ -89,46 +92,105 @@ functions = (update_driver, get_saved_log_level, save_log_level, set_logging_lev
         },
     ]
 
+    Values are converted and checked when they are set, get() just
+    returns the result.  An invalid value is logged and the default
+    is used in its place.
+
+    subscribe() registers a function to be called (with no arguments)
+    when the value of any of the named parameters changes.
+
     usage:
        self.params = NSParameters(param_list)
        self.params.get('param1')
        if self.params.isSet('param1'):
+       self.params.subscribe(self.set_param1, 'param1')
 
 """
 
+def boolean(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in ('true', 'yes', 'on', '1'):
+        return True
+    if value in ('false', 'no', 'off', '0', ''):
+        return False
+    raise ValueError('not true or false')
+
+
 class NSParameters:
     def __init__(self, parameters):
         self.internal = []
+        self.index = {}
+        self.subscribers = []
 
         for p in parameters:
-            self.internal.append({
+            param = {
                 'name': p['name'],
                 'value': '', 
                 'default': p['default'],
                 'isSet': False,
                 'isRequired': p['isRequired'],
                 'notice_msg': p['notice'],
-                })
+                'type': p.get('type'),
+                'choices': p.get('choices'),
+                }
+            param['default_parsed'] = self.convert(param, p['default'])
+            param['parsed'] = param['default_parsed']
+            self.internal.append(param)
+            self.index[p['name']] = param
+
+    def convert(self, p, value):
+        if p['type'] is not None:
+            value = p['type'](value)
+        if p['choices'] is not None:
+            value = str(value).strip().lower()
+            if value not in p['choices']:
+                raise ValueError('not one of ' + ', '.join(p['choices']))
+        return value
+
+    def store(self, p, value):
+        """
+            Set the raw value and convert it.  Returns True if the
+            converted value changed.
+        """
+        p['value'] = value
+        p['isSet'] = (str(value) != str(p['default']))
+        try:
+            parsed = self.convert(p, value)
+        except (TypeError, ValueError) as e:
+            LOGGER.error('Invalid value ' + str(value) + ' for ' + p['name'] +
+                    ' (' + str(e) + '), using ' + str(p['default']))
+            parsed = p['default_parsed']
+        old = p['parsed']
+        p['parsed'] = parsed
+        return old != parsed
+
+    def subscribe(self, callback, *names):
+        self.subscribers.append((callback, set(names)))
+
+    def notify(self, names):
+        for (callback, wanted) in self.subscribers:
+            if wanted.intersection(names):
+                try:
+                    callback()
+                except Exception as e:
+                    LOGGER.error('Parameter change handler failed: ' + str(e))
 
     def set(self, name, value):
-        for p in self.internal:
-            if p['name'] == name:
-                p['value'] = value
-                p['isSet'] = True
-                return
+        p = self.index.get(name)
+        if p is not None and self.store(p, value):
+            self.notify([name])
 
     def get(self, name):
-        for p in self.internal:
-            if p['name'] == name:
-                if p['isSet']:
-                    return p['value']
-                else:
-                    return p['default']
+        p = self.index.get(name)
+        if p is not None:
+            return p['parsed']
 
     def isSet(self, name):
-        for p in self.internal:
-            if p['name'] == name:
-                return p['isSet']
+        p = self.index.get(name)
+        if p is not None:
+            return p['isSet']
         return False
 
     """
@@ -150,15 +212,15 @@ class NSParameters:
     def get_from_polyglot(self, poly):
         customParams = poly.polyConfig['customParams']
         params = {}
+        changed = []
 
         for p in self.internal:
             LOGGER.debug('checking for ' + p['name'] + ' in customParams')
             if p['name'] in customParams:
                 LOGGER.debug('found ' + p['name'] + ' in customParams')
-                p['value'] = customParams[p['name']]
-                if p['value'] != p['default']:
-                    LOGGER.debug(p['name'] + ' is now set')
-                    p['isSet'] = True
+                if self.store(p, customParams[p['name']]):
+                    LOGGER.debug(p['name'] + ' is now ' + str(p['value']))
+                    changed.append(p['name'])
             
             if p['isSet']:
                 params[p['name']] = p['value']
@@ -167,6 +229,9 @@ class NSParameters:
 
         poly.addCustomParam(params)            
 
+        if changed:
+            self.notify(changed)
+
         for p in self.internal:
             if not p['isSet'] and p['isRequired']:
                 return False
@@ -181,25 +246,29 @@ class NSParameters:
     def update_from_polyglot(self, config):
         changed = False
         valid = True
+        updated = []
 
         if 'customParams' in config:
             for p in self.internal:
                 if p['name'] in config['customParams']:
                     poly_param = config['customParams'][p['name']]
 
-                    # did it change?
-                    if poly_param != p['default'] and poly_param != p['value']:
+                    # did it change?  Going back to the default is a
+                    # change too.
+                    current = p['value'] if p['isSet'] else p['default']
+                    if str(poly_param) != str(current):
                         changed = True
 
-                    # is it different from the default?
-                    if poly_param != p['default']:
-                        p['value'] = poly_param
-                        p['isSet'] = True
+                    if self.store(p, poly_param):
+                        updated.append(p['name'])
 
         for p in self.internal:
             if not p['isSet'] and p['isRequired']:
                 valid = False
 
+        if updated:
+            self.notify(updated)
+
         return (valid, changed)
 
     def save_params(self, poly):
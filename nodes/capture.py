@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for WeatherFlow Weather Station data.
+Copyright (c) 2018,2019 Robert Paauwe
+
+Raw UDP packet capture.  When the CaptureFile parameter is set, every
+datagram read from the socket is appended to the file, before any
+filtering, so problems can be replayed offline with tools/replay.py.
+
+File format: a 6 byte header (b'WFCAP1') followed by one record per
+datagram:
+    8 byte little endian double  - time.time() when received
+    2 byte little endian ushort  - length of the datagram
+    datagram bytes
+"""
+import polyinterface
+import time
+import struct
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+MAGIC = b'WFCAP1'
+RECORD = struct.Struct('<dH')
+
+
+class Capture(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.packets = 0
+        self.bytes = 0
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        LOGGER.info('Capturing UDP packets to ' + path)
+
+    def write(self, raw, ts=None):
+        if ts is None:
+            ts = time.time()
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(RECORD.pack(ts, len(raw)))
+            self.file.write(raw)
+            self.packets += 1
+            self.bytes += RECORD.size + len(raw)
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        LOGGER.info('Captured {} packets, {} bytes'.format(self.packets, self.bytes))
+
+
+def read(path):
+    """
+        Generator returning (timestamp, raw datagram) for each record in
+        a capture file.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + ' is not a WeatherFlow capture file')
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            (ts, length) = RECORD.unpack(header)
+            raw = f.read(length)
+            if len(raw) < length:
+                return
+            yield (ts, raw)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for WeatherFlow Weather Station data.
+Copyright (c) 2018,2019 Robert Paauwe
+
+Unit conversion for the sensor nodes.  Values come from the station in
+metric (C, kph, mb, mm, mm/hr, km) and are converted to the units each
+node is configured for.
+
+A node describes which quantity each of its drivers holds and, when its
+units are set, gets one converter per driver.  The unit lookup happens
+then, not on every update.  Each converter also rounds to the precision
+for its units so every node rounds the same way.  The precisions are the
+ones the nodes have always used, so ISY programs comparing against the
+values see the same numbers.  Speeds in kph, pressure in mb and distance
+in km are sent as they come from the station, not rounded.  Speeds in
+m/s, which used to be sent as kph by mistake, are rounded to 2 places.
+
+usage:
+    convert = conversion.converters({'ST': 'temperature'}, 'f')
+    convert['ST'](21.5)       -> 70.7
+    conversion.convert_vector(convert, ('ST', 'GV0'), (21.5, 20.1))
+"""
+import polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+# (quantity, unit) -> (scale, offset, precision).  The first entry for
+# a quantity is the metric unit, used when the unit isn't known.  A
+# precision of None means the value isn't rounded.
+CONVERSIONS = (
+        (('temperature', 'c'), (1.0, 0.0, 1)),
+        (('temperature', 'uk'), (1.0, 0.0, 1)),
+        (('temperature', 'f'), (1.8, 32.0, 1)),
+        (('speed', 'kph'), (1.0, 0.0, None)),
+        (('speed', 'ms'), (1 / 3.6, 0.0, 2)),
+        (('speed', 'mph'), (1 / 1.609344, 0.0, 2)),
+        (('pressure', 'mb'), (1.0, 0.0, None)),
+        (('pressure', 'inhg'), (0.02952998751, 0.0, 3)),
+        (('rain', 'mm'), (1.0, 0.0, 3)),
+        (('rain', 'in'), (0.03937, 0.0, 2)),
+        (('distance', 'km'), (1.0, 0.0, None)),
+        (('distance', 'mi'), (1 / 1.609344, 0.0, 1)),
+        )
+
+TABLE = dict(CONVERSIONS)
+METRIC = {}
+for ((quantity, unit), rule) in CONVERSIONS:
+    METRIC.setdefault(quantity, rule)
+
+
+def identity(value):
+    return value
+
+
+def converter(quantity, unit):
+    """
+        Returns a function that converts a metric value of quantity to
+        unit and rounds it.  None is passed through.
+    """
+    rule = TABLE.get((quantity, unit))
+    if rule is None:
+        LOGGER.warning('No ' + quantity + ' conversion to ' + str(unit) + ', using metric')
+        rule = METRIC[quantity]
+    (scale, offset, prec) = rule
+
+    if prec is None and scale == 1.0 and offset == 0.0:
+        return identity
+    if scale == 1.0 and offset == 0.0:
+        def convert(value):
+            if value is None:
+                return None
+            return round(value, prec)
+    else:
+        def convert(value):
+            if value is None:
+                return None
+            return round(value * scale + offset, prec)
+    return convert
+
+
+def converters(quantities, unit):
+    """
+        Build the driver -> converter table for a node.  quantities maps
+        each driver to its quantity, or None if it isn't converted.
+    """
+    table = {}
+    for (driver, quantity) in quantities.items():
+        if quantity is None:
+            table[driver] = identity
+        else:
+            table[driver] = converter(quantity, unit)
+    return table
+
+
+def convert_vector(convert, drivers, values):
+    """
+        Convert a whole observation at once.  Returns a list of
+        (driver, value).
+    """
+    return [(d, convert[d](v)) for (d, v) in zip(drivers, values)]
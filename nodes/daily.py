@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for WeatherFlow Weather Station data.
+Copyright (c) 2018,2019 Robert Paauwe
+
+Daily high, low and mean of temperature, humidity, sea level pressure
+and wind gust for today and yesterday.  Each sample only updates a
+running min/max/sum so the cost doesn't depend on how many samples a
+day has.
+
+Days start at the station's local midnight.  The epoch of the next
+midnight is computed once per day, after that a sample only needs a
+compare to know if it belongs to today.  Samples older than today are
+added to yesterday if they fit there and dropped otherwise.
+
+The state is a plain dictionary (save()/restore()) so it can be kept
+with the rain accumulations.
+
+usage:
+    stats = daily.DailyStats(periods.zone('America/Los_Angeles'))
+    stats.add('temperature', 21.4, 1588948614)
+    (high, low, mean, y_high, y_low, y_mean) = stats.values('temperature')
+"""
+import polyinterface
+import datetime
+import threading
+from nodes import periods
+
+LOGGER = polyinterface.LOGGER
+
+QUANTITIES = ('temperature', 'humidity', 'pressure', 'gust')
+
+
+class Aggregate(object):
+    __slots__ = ('low', 'low_ts', 'high', 'high_ts', 'total', 'count')
+
+    def __init__(self, values=None):
+        if values is None:
+            values = (None, 0, None, 0, 0.0, 0)
+        (self.low, self.low_ts, self.high, self.high_ts, self.total,
+                self.count) = values
+
+    def add(self, value, ts):
+        if self.count == 0 or value < self.low:
+            self.low = value
+            self.low_ts = ts
+        if self.count == 0 or value > self.high:
+            self.high = value
+            self.high_ts = ts
+        self.total += value
+        self.count += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def save(self):
+        return [self.low, self.low_ts, self.high, self.high_ts, self.total,
+                self.count]
+
+
+class DailyStats(object):
+    def __init__(self, tz=None):
+        self.lock = threading.Lock()
+        self.tz = tz
+        self.day = None     # local date of today
+        self.starts = 0     # epoch today started
+        self.ends = 0       # epoch today ends
+        self.yesterday_starts = 0
+        self.today = dict((q, Aggregate()) for q in QUANTITIES)
+        self.yesterday = dict((q, Aggregate()) for q in QUANTITIES)
+
+    def set_day(self, day):
+        self.day = day
+        self.starts = periods.midnight(day, self.tz)
+        self.ends = periods.midnight(day + datetime.timedelta(days=1), self.tz)
+        self.yesterday_starts = periods.midnight(day - datetime.timedelta(days=1),
+                self.tz)
+
+    def rollover(self, ts):
+        day = periods.local_date(ts, self.tz)
+        if self.day is not None and day - self.day == datetime.timedelta(days=1):
+            self.yesterday = self.today
+        else:
+            # first sample or we missed a whole day
+            self.yesterday = dict((q, Aggregate()) for q in QUANTITIES)
+        self.today = dict((q, Aggregate()) for q in QUANTITIES)
+        if self.day is not None:
+            LOGGER.info('Daily statistics rolled over to ' + str(day))
+        self.set_day(day)
+
+    def add(self, quantity, value, ts):
+        if value is None or ts is None:
+            return
+        with self.lock:
+            if ts >= self.ends:
+                self.rollover(ts)
+            elif ts < self.starts:
+                if ts >= self.yesterday_starts:
+                    self.yesterday[quantity].add(value, ts)
+                return
+            self.today[quantity].add(value, ts)
+
+    def values(self, quantity):
+        """
+            Returns (high, low, mean) for today followed by the same
+            for yesterday.  None where there were no samples.
+        """
+        with self.lock:
+            t = self.today[quantity]
+            y = self.yesterday[quantity]
+            return (t.high, t.low, t.mean(), y.high, y.low, y.mean())
+
+    def extremes(self):
+        """
+            The day and its highs and lows, what's worth saving when it
+            changes.  The means move with every sample.
+        """
+        with self.lock:
+            return (self.day,) + tuple((a.low, a.high) for part in
+                    (self.today, self.yesterday) for a in part.values())
+
+    def save(self):
+        with self.lock:
+            if self.day is None:
+                return None
+            return {
+                    'day': self.day.toordinal(),
+                    'today': dict((q, self.today[q].save()) for q in QUANTITIES),
+                    'yesterday': dict((q, self.yesterday[q].save()) for q in QUANTITIES),
+                    }
+
+    def restore(self, data):
+        if not data:
+            return
+        try:
+            day = datetime.date.fromordinal(data['day'])
+            today = dict((q, Aggregate(data['today'][q])) for q in QUANTITIES)
+            yesterday = dict((q, Aggregate(data['yesterday'][q])) for q in QUANTITIES)
+        except Exception as e:
+            LOGGER.error('Ignoring saved daily statistics: ' + str(e))
+            return
+        with self.lock:
+            self.today = today
+            self.yesterday = yesterday
+            self.set_day(day)
@@ -15,6 +15,13 @@ import threading
 
 LOGGER = polyinterface.LOGGER
 
+# sensor_status bits 0 - 8 and the drivers that show them
+SENSOR_DRIVERS = ('GV7', 'GV8', 'GV9', 'GV10', 'GV11', 'GV12', 'GV13',
+        'GV14', 'GV15')
+SENSOR_NAMES = ('lightning sensor', 'lightning noise', 'lightning disturber',
+        'pressure sensor', 'temperature sensor', 'humidity sensor',
+        'wind sensor', 'precipitation sensor', 'light/UV sensor')
+
 # How do we do some initialization when the class object is created?
 # can we manuipulate the node somewhat here?
 
@@ -31,50 +38,58 @@ class HubNode(polyinterface.Node):
         self.tempest = False
         self.sky = False
         self.air = False
+        # per device sensor_status bitmask, failure counts and time of
+        # the last change, per bit.
+        self.sensor_status = {}
+        self.sensor_failures = {}
+        self.sensor_changed = {}
+        # Each station has its own hub node so the drivers and node
+        # def are per instance.
+        self.drivers = []
         for device in devices:
             if 'SK' in device:
                 self.sky = True
                 LOGGER.debug('add sky battery and RSSI')
-                HubNode.drivers.append({'driver': 'GV1', 'value': 0, 'uom': 72})
-                HubNode.drivers.append({'driver': 'GV3', 'value': 0, 'uom': 56})
-                HubNode.drivers.append({'driver': 'GV13', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV14', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV15', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV1', 'value': 0, 'uom': 72})
+                self.drivers.append({'driver': 'GV3', 'value': 0, 'uom': 56})
+                self.drivers.append({'driver': 'GV13', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV14', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV15', 'value': 0, 'uom': 25})
             if 'AR' in device:
                 self.air = True
                 LOGGER.debug('add air battery and RSSI')
-                HubNode.drivers.append({'driver': 'GV0', 'value': 0, 'uom': 72})
-                HubNode.drivers.append({'driver': 'GV2', 'value': 0, 'uom': 56})
-                HubNode.drivers.append({'driver': 'GV7', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV8', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV9', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV10', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV11', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV12', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV0', 'value': 0, 'uom': 72})
+                self.drivers.append({'driver': 'GV2', 'value': 0, 'uom': 56})
+                self.drivers.append({'driver': 'GV7', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV8', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV9', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV10', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV11', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV12', 'value': 0, 'uom': 25})
             if 'ST' in device:
                 self.tempest = True
                 LOGGER.debug('add tempest battery and RSSI')
-                HubNode.drivers.append({'driver': 'GV5', 'value': 0, 'uom': 72})
-                HubNode.drivers.append({'driver': 'GV6', 'value': 0, 'uom': 56})
-
-                HubNode.drivers.append({'driver': 'GV7', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV8', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV9', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV10', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV11', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV12', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV13', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV14', 'value': 0, 'uom': 25})
-                HubNode.drivers.append({'driver': 'GV15', 'value': 0, 'uom': 25})
-        LOGGER.debug(HubNode.drivers)
+                self.drivers.append({'driver': 'GV5', 'value': 0, 'uom': 72})
+                self.drivers.append({'driver': 'GV6', 'value': 0, 'uom': 56})
+
+                self.drivers.append({'driver': 'GV7', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV8', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV9', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV10', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV11', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV12', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV13', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV14', 'value': 0, 'uom': 25})
+                self.drivers.append({'driver': 'GV15', 'value': 0, 'uom': 25})
+        LOGGER.debug(self.drivers)
         if self.tempest:
-            HubNode.id = 'hub2'
+            self.id = 'hub2'
         elif self.air and self.sky:
-            HubNode.id = 'hub3'
+            self.id = 'hub3'
         elif self.air:
-            HubNode.id = 'hub1'
+            self.id = 'hub1'
         elif self.sky:
-            HubNode.id = 'hub0'
+            self.id = 'hub0'
         else:
             LOGGER.error('No sensor devices found (Sky, Air, Tempest)')
 
@@ -86,7 +101,7 @@ class HubNode(polyinterface.Node):
         self.units = u
 
     def setDriver(self, driver, value):
-        super(HubNode, self).setDriver(driver, value, report=True, force=True)
+        self.controller.publisher.publish(self, driver, value)
 
     def update_rssi(self, rssi_1=None, rssi_2=None):
         if self.tempest:
@@ -108,49 +123,60 @@ class HubNode(polyinterface.Node):
                 self.setDriver('GV1', v2)
 
 
-    def update_sensors(self, status):
-        if (status & 0x0001) == 0x0001:
-            self.setDriver('GV7', 1)
-        else:
-            self.setDriver('GV7', 0)
-
-        if (status & 0x0002) == 0x0002:
-            self.setDriver('GV8', 1)
-        else:
-            self.setDriver('GV8', 0)
-
-        if (status & 0x0004) == 0x0004:
-            self.setDriver('GV9', 1)
-        else:
-            self.setDriver('GV9', 0)
-
-        if (status & 0x0008) == 0x0008:
-            self.setDriver('GV10', 1)
-        else:
-            self.setDriver('GV10', 0)
-
-        if (status & 0x0010) == 0x0010:
-            self.setDriver('GV11', 1)
-        else:
-            self.setDriver('GV11', 0)
-
-        if (status & 0x0020) == 0x0020:
-            self.setDriver('GV12', 1)
+    def update_sensors(self, status, device=''):
+        """
+            Only the sensor_status bits that changed since the last
+            device_status from this device are sent.  Each bit going
+            from ok to failed is counted and the time of the last
+            change of each bit is kept.
+        """
+        status &= self.sensor_mask(device)
+        last = self.sensor_status.get(device)
+        if last is None:
+            # first status from this device, send every bit it has
+            changed = self.sensor_mask(device)
+            self.sensor_failures[device] = [0] * len(SENSOR_DRIVERS)
+            self.sensor_changed[device] = [0] * len(SENSOR_DRIVERS)
         else:
-            self.setDriver('GV12', 0)
-
-        if (status & 0x0040) == 0x0040:
-            self.setDriver('GV13', 1)
-        else:
-            self.setDriver('GV13', 0)
-
-        if (status & 0x0080) == 0x0080:
-            self.setDriver('GV14', 1)
-        else:
-            self.setDriver('GV14', 0)
-
-        if (status & 0x0100) == 0x0100:
-            self.setDriver('GV15', 1)
-        else:
-            self.setDriver('GV15', 0)
-
+            changed = status ^ last
+            if changed == 0:
+                return
+        self.sensor_status[device] = status
+
+        now = time.time()
+        failures = self.sensor_failures[device]
+        when = self.sensor_changed[device]
+        for bit in range(len(SENSOR_DRIVERS)):
+            if changed & (1 << bit):
+                state = (status >> bit) & 1
+                self.setDriver(SENSOR_DRIVERS[bit], state)
+                if last is None:
+                    continue
+                when[bit] = now
+                if state:
+                    failures[bit] += 1
+                    LOGGER.warning('{} {} failed ({} times)'.format(device,
+                        SENSOR_NAMES[bit], failures[bit]))
+                else:
+                    LOGGER.info('{} {} ok'.format(device, SENSOR_NAMES[bit]))
+
+    def sensor_mask(self, device):
+        # the bits the device reports on
+        if 'AR' in device:
+            return 0x003f
+        if 'SK' in device:
+            return 0x01c0
+        return 0x01ff
+
+    def sensor_history(self):
+        """
+            Returns {device: [(name, failures, last change time), ...]}
+            for every bit that has changed.
+        """
+        history = {}
+        for device in self.sensor_failures:
+            failures = self.sensor_failures[device]
+            when = self.sensor_changed[device]
+            history[device] = [(SENSOR_NAMES[bit], failures[bit], when[bit])
+                    for bit in range(len(SENSOR_DRIVERS)) if when[bit]]
+        return history
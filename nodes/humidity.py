@@ -19,14 +19,27 @@ class HumidityNode(polyinterface.Node):
     id = 'humidity'
     hint = [1,11,2,0]
     units = 'metric'
-    drivers = [{'driver': 'ST', 'value': 0, 'uom': 22}]
+    drivers = [
+            {'driver': 'ST', 'value': 0, 'uom': 22},
+            {'driver': 'GV0', 'value': 0, 'uom': 22}, # high today
+            {'driver': 'GV1', 'value': 0, 'uom': 22}, # low today
+            {'driver': 'GV2', 'value': 0, 'uom': 22}, # mean today
+            {'driver': 'GV3', 'value': 0, 'uom': 22}, # high yesterday
+            {'driver': 'GV4', 'value': 0, 'uom': 22}, # low yesterday
+            {'driver': 'GV5', 'value': 0, 'uom': 22}  # mean yesterday
+            ]
 
     def SetUnits(self, u):
         self.units = u
 
     def setDriver(self, driver, value):
-        super(HumidityNode, self).setDriver(driver, value, report=True, force=True)
+        self.controller.publisher.publish(self, driver, value)
 
     def update(self, h):
         self.setDriver('ST', h)
 
+    # (high, low, mean) today and yesterday from daily.DailyStats
+    def update_daily(self, values):
+        for (driver, value) in zip(('GV0', 'GV1', 'GV2', 'GV3', 'GV4', 'GV5'), values):
+            if value is not None:
+                self.setDriver(driver, round(value, 1))
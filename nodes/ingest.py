@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for WeatherFlow Weather Station data.
+Copyright (c) 2018,2019 Robert Paauwe
+
+UDP ingest engines.  These own the socket that listens for the hub
+broadcasts.  Each raw datagram is checked by a PacketFilter, without
+decoding it, and packets we want are pushed into a bounded PacketQueue.
+A separate processing worker drains the queue, decodes each packet and
+hands it to a handler function.
+
+  ThreadReceiver - blocking recvfrom() loop.  The default, it has the
+                   lower latency and drops less in bench_ingest.
+  AsyncReceiver  - asyncio DatagramProtocol based.  The socket is
+                   serviced by an event loop.
+
+usage:
+    receiver = ingest.ThreadReceiver(50222, handler,
+                   ingest.PacketQueue(256, 'coalesce'),
+                   ingest.PacketFilter(['ST-00000512']))
+    receiver.start()
+    ...
+    receiver.stop()
+
+  handler is called as handler(data, received) where data is the
+  decoded json packet and received is the time.monotonic() value when
+  the datagram was read from the socket.
+"""
+import polyinterface
+import time
+import json
+import socket
+import select
+import asyncio
+import abc
+import heapq
+import threading
+import collections
+from nodes import metrics
+
+LOGGER = polyinterface.LOGGER
+
+MODES = ('thread', 'asyncio')
+POLICIES = ('coalesce', 'drop-oldest')
+
+# Packet types that only carry current state.  When the queue policy is
+# coalesce, a newer one of these replaces an older one from the same
+# device that is still waiting in the queue.  Observations and events
+# carry accumulations and are never coalesced.  Neither is rapid_wind,
+# every sample is needed to track the peak gust.
+COALESCE_TYPES = (b'device_status', b'hub_status')
+
+# Event packets.  These skip ahead of everything else waiting in the
+# queue so lightning and rain onset are reported right away.
+EVENT_TYPES = (b'evt_strike', b'evt_precip')
+
+# Packet types the node server does something with.
+HANDLED_TYPES = ('obs_air', 'obs_sky', 'obs_st', 'device_status',
+        'hub_status', 'rapid_wind', 'evt_strike', 'evt_precip')
+
+
+def open_socket(port):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind(('0.0.0.0', int(port)))
+    return s
+
+
+def decode(raw):
+    return json.loads(raw.decode('utf-8'))
+
+
+def field(raw, name):
+    """
+        Pull a string field value out of the raw json without decoding
+        the whole packet.  Returns None if the field isn't found.
+    """
+    i = raw.find(b'"' + name + b'"')
+    if i < 0:
+        return None
+    i = raw.find(b':', i + len(name) + 2)
+    if i < 0:
+        return None
+    i = raw.find(b'"', i) + 1
+    if i <= 0:
+        return None
+    j = raw.find(b'"', i)
+    if j < 0:
+        return None
+    return raw[i:j]
+
+
+class PacketFilter(object):
+    """
+        Decide if a datagram is wanted by looking at the raw bytes.  The
+        serial_number and type are pulled straight out of the packet and
+        checked against pre-built sets so packets from other stations,
+        or of types we don't handle, never get decoded.
+    """
+    def __init__(self, serials=None, types=HANDLED_TYPES):
+        self.types = frozenset(t.encode('utf-8') for t in types)
+        self.serials = frozenset()
+        self.accepted = 0
+        self.rejected = 0
+        if serials is not None:
+            self.set_serials(serials)
+
+    def set_serials(self, serials):
+        # replaced as a whole so the receive thread never sees a
+        # partially built set.
+        self.serials = frozenset(str(s).encode('utf-8') for s in serials)
+
+    def set_types(self, types):
+        self.types = frozenset(t.encode('utf-8') for t in types)
+
+    def classify(self, raw):
+        """
+            Returns (serial, type) as bytes if the packet is wanted or
+            None if it should be dropped.
+        """
+        serial = field(raw, b'serial_number')
+        if serial not in self.serials:
+            self.rejected += 1
+            return None
+        ptype = field(raw, b'type')
+        if ptype not in self.types:
+            self.rejected += 1
+            return None
+        self.accepted += 1
+        return (serial, ptype)
+
+
+def packet_time(data):
+    """
+        The device timestamp of a decoded packet or None if it doesn't
+        have one.
+    """
+    try:
+        ptype = data['type']
+        if ptype.startswith('obs_'):
+            return data['obs'][0][0]
+        if ptype == 'rapid_wind':
+            return data['ob'][0]
+        if ptype.startswith('evt_'):
+            return data['evt'][0]
+        return data.get('timestamp')
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def packet_identity(data):
+    """
+        What tells a packet apart from the others of its type.  An
+        observation is identified by its timestamp.  Two events can
+        happen in the same second (lightning strikes at different
+        distances), so they're identified by the whole event.
+    """
+    try:
+        ptype = data['type']
+        if ptype.startswith('evt_'):
+            return tuple(data['evt'])
+        if ptype == 'rapid_wind':
+            return tuple(data['ob'])
+    except (KeyError, TypeError):
+        return None
+    return packet_time(data)
+
+
+class Dedup(object):
+    """
+        Sliding window duplicate check, per device and packet type.
+
+        The packet identities (see packet_identity()) seen in the last
+        window seconds are kept for each (serial, type) so a packet
+        rebroadcast by a repeater or a second hub, or one that shows up
+        out of order, is only handled once.  An observation older than
+        the window can't be checked and is dropped as late, events are
+        always handled unless they're a repeat.  At most size packets
+        are kept per key.  They're kept in a heap so the oldest is
+        expired first even when packets arrive out of order.
+    """
+    def __init__(self, window=600, size=256):
+        self.window = window
+        self.size = size
+        self.seen = {}
+        self.added = 0
+        self.duplicates = 0
+        self.late = 0
+        self.reordered = 0
+
+    def check(self, serial, ptype, ts, identity=None):
+        """
+            Returns True if the packet should be handled.  identity
+            defaults to the timestamp.
+        """
+        if ts is None:
+            return True
+        if identity is None:
+            identity = ts
+
+        key = (serial, ptype)
+        entry = self.seen.get(key)
+        if entry is None:
+            entry = (set(), [], [ts])
+            self.seen[key] = entry
+        (seen, order, newest) = entry
+
+        if identity in seen:
+            self.duplicates += 1
+            return False
+        if ts < newest[0] - self.window and ptype.startswith('obs_'):
+            self.late += 1
+            return False
+        if ts < newest[0]:
+            self.reordered += 1
+        else:
+            newest[0] = ts
+
+        seen.add(identity)
+        # the sequence number keeps the identities from being compared
+        self.added += 1
+        heapq.heappush(order, (ts, self.added, identity))
+        oldest = newest[0] - self.window
+        while len(order) > self.size or order[0][0] < oldest:
+            seen.discard(heapq.heappop(order)[2])
+
+        return True
+
+    def stats(self):
+        return {
+                'duplicates': self.duplicates,
+                'late': self.late,
+                'reordered': self.reordered,
+                }
+
+
+class PacketQueue(object):
+    """
+        Bounded FIFO of raw datagrams sitting between the socket and
+        the processing worker.
+
+        When full, the oldest queued packet is dropped to make room.
+        With the coalesce policy, state-only packets (COALESCE_TYPES)
+        also replace an older packet of the same device and type that
+        hasn't been processed yet.
+
+        Events (EVENT_TYPES) go in their own queue which is always
+        drained first.
+    """
+    def __init__(self, size=256, policy='coalesce'):
+        self.size = max(1, int(size))
+        self.coalesce = (policy == 'coalesce')
+        self.queue = collections.deque()
+        self.events = collections.deque()
+        self.pending = {}
+        self.cond = threading.Condition()
+        self.closed = False
+
+        self.received = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def put(self, raw, received, serial=None, ptype=None):
+        if ptype is None:
+            ptype = field(raw, b'type')
+
+        if ptype in EVENT_TYPES:
+            with self.cond:
+                self.received += 1
+                if len(self.events) >= self.size:
+                    self.events.popleft()
+                    self.dropped += 1
+                self.events.append((raw, received))
+                self.cond.notify()
+            return
+
+        key = None
+        if self.coalesce:
+            if ptype in COALESCE_TYPES:
+                if serial is None:
+                    serial = field(raw, b'serial_number')
+                key = (serial, ptype)
+
+        with self.cond:
+            self.received += 1
+            if key is not None and key in self.pending:
+                entry = self.pending[key]
+                entry[1] = raw
+                entry[2] = received
+                self.coalesced += 1
+                return
+
+            if len(self.queue) >= self.size:
+                old = self.queue.popleft()
+                if old[0] is not None and self.pending.get(old[0]) is old:
+                    del self.pending[old[0]]
+                self.dropped += 1
+
+            entry = [key, raw, received]
+            self.queue.append(entry)
+            if key is not None:
+                self.pending[key] = entry
+            if len(self.queue) > self.max_depth:
+                self.max_depth = len(self.queue)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """
+            Returns (raw, received) or None if the timeout expired or
+            the queue was closed and everything in it has been handed
+            out.
+        """
+        with self.cond:
+            while not self.queue and not self.events and not self.closed:
+                if not self.cond.wait(timeout) and timeout is not None:
+                    return None
+            if not self.queue and not self.events:
+                return None
+
+            if self.events:
+                return self.events.popleft()
+
+            entry = self.queue.popleft()
+            if entry[0] is not None and self.pending.get(entry[0]) is entry:
+                del self.pending[entry[0]]
+            return (entry[1], entry[2])
+
+    def close(self):
+        # Nothing more will be put.  What's already queued can still be
+        # taken with get().
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def discard(self):
+        """
+            Throw away everything still queued.  Returns the number of
+            packets dropped.
+        """
+        with self.cond:
+            count = len(self.queue) + len(self.events)
+            self.queue.clear()
+            self.events.clear()
+            self.pending = {}
+            self.dropped += count
+            self.cond.notify_all()
+            return count
+
+    def depth(self):
+        return len(self.queue) + len(self.events)
+
+    def stats(self):
+        return {
+                'depth': self.depth(),
+                'max_depth': self.max_depth,
+                'received': self.received,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                }
+
+
+class Receiver(abc.ABC):
+    def __init__(self, port, handler, queue=None, packet_filter=None):
+        self.port = int(port)
+        self.handler = handler
+        self.queue = queue if queue is not None else PacketQueue()
+        self.filter = packet_filter
+        self.capture = None
+        self.metrics = metrics.Metrics()
+        self.stopping = False
+        self.thread = None
+        self.worker = None
+
+    @property
+    def stopped(self):
+        for t in (self.thread, self.worker):
+            if t is not None and t.is_alive():
+                return False
+        return True
+
+    def start(self):
+        self.stopping = False
+        self.worker = threading.Thread(target=self.process)
+        self.worker.daemon = True
+        self.worker.start()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping = True
+        self.queue.close()
+        self.wake()
+
+    def wake(self):
+        # Break the receive thread out of waiting on the socket
+        pass
+
+    def join(self, timeout=None):
+        for t in (self.thread, self.worker):
+            if t is not None:
+                t.join(timeout)
+
+    def shutdown(self, timeout=5.0):
+        """
+            Stop receiving, give the worker up to timeout seconds to
+            finish the packets already queued, then drop whatever is
+            left.  Returns True if both threads have exited.
+        """
+        deadline = time.monotonic() + timeout
+        self.stop()
+        if self.thread is not None:
+            self.thread.join(max(0, deadline - time.monotonic()))
+        if self.worker is not None:
+            self.worker.join(max(0, deadline - time.monotonic()))
+            if self.worker.is_alive():
+                LOGGER.warning('Dropped {} queued packets at shutdown'.format(
+                    self.queue.discard()))
+                self.worker.join(1.0)
+        return self.stopped
+
+    def receive(self, raw, received):
+        if self.capture is not None:
+            self.capture.write(raw)
+
+        if self.filter is None:
+            self.queue.put(raw, received)
+            return
+
+        key = self.filter.classify(raw)
+        if key is not None:
+            self.queue.put(raw, received, key[0], key[1])
+
+    def process(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.dispatch(item[0], item[1])
+
+    def dispatch(self, raw, received):
+        m = self.metrics
+        t = m.start()
+        try:
+            data = decode(raw)
+        except:
+            LOGGER.error('JSON processing of data failed')
+            return
+        m.stop(metrics.DECODE, t)
+
+        t = m.start()
+        try:
+            self.handler(data, received)
+        except Exception as e:
+            LOGGER.error('Failed to process packet: ' + str(e))
+        m.stop(metrics.DISPATCH, t)
+        m.commit(data.get('type'))
+
+    @abc.abstractmethod
+    def run(self):
+        """ Receive datagrams and pass them to receive(). """
+
+
+class ThreadReceiver(Receiver):
+    """
+        Blocking receive loop.  Datagrams are only queued here, the
+        processing worker does the rest.
+    """
+    def __init__(self, port, handler, queue=None, packet_filter=None):
+        super(ThreadReceiver, self).__init__(port, handler, queue,
+                packet_filter)
+        # self-pipe, stop() writes to it so select() returns right away
+        (self.wake_r, self.wake_w) = socket.socketpair()
+
+    def wake(self):
+        try:
+            self.wake_w.send(b'x')
+        except OSError:
+            pass
+
+    def run(self):
+        s = open_socket(self.port)
+
+        LOGGER.info("Starting UDP receive loop")
+        while not self.stopping:
+            try:
+                (ready, w, x) = select.select([s, self.wake_r], [], [])
+                if s not in ready:
+                    continue
+                hub = s.recvfrom(1024)  # hub is a tuple (json, (ip, port))
+            except Exception as e:
+                LOGGER.error('UDP receive failed: ' + str(e))
+                continue
+
+            self.receive(hub[0], time.monotonic())
+
+        s.close()
+        self.wake_r.close()
+        self.wake_w.close()
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    def datagram_received(self, raw, addr):
+        self.receiver.receive(raw, time.monotonic())
+
+    def error_received(self, exc):
+        LOGGER.error('UDP receive failed: ' + str(exc))
+
+
+class AsyncReceiver(Receiver):
+    """
+        Event loop based receiver.  The loop only reads the socket and
+        queues the datagrams.
+    """
+    def __init__(self, port, handler, queue=None, packet_filter=None):
+        super(AsyncReceiver, self).__init__(port, handler, queue,
+                packet_filter)
+        self.loop = None
+
+    def wake(self):
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+            except RuntimeError:
+                # loop already closed
+                pass
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        try:
+            transport, protocol = self.loop.run_until_complete(
+                    self.loop.create_datagram_endpoint(
+                        lambda: DatagramProtocol(self),
+                        sock=open_socket(self.port)))
+        except Exception as e:
+            LOGGER.error('Failed to start UDP listener: ' + str(e))
+            self.loop.close()
+            return
+
+        LOGGER.info("Starting UDP event loop")
+        if not self.stopping:
+            self.loop.run_forever()
+
+        transport.close()
+        self.loop.close()
+
+
+def create(mode, port, handler, queue=None, packet_filter=None):
+    if mode == 'asyncio':
+        return AsyncReceiver(port, handler, queue, packet_filter)
+    return ThreadReceiver(port, handler, queue, packet_filter)
@@ -29,7 +29,7 @@ class LightNode(polyinterface.Node):
         self.units = u
 
     def setDriver(self, driver, value):
-        super(LightNode, self).setDriver(driver, value, report=True, force=True)
+        self.controller.publisher.publish(self, driver, value)
 
     def update(self, uv, sr, il):
         self.setDriver('ST', uv)
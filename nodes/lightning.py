@@ -12,6 +12,7 @@ import json
 import socket
 import math
 import threading
+from nodes import conversion
 
 LOGGER = polyinterface.LOGGER
 
@@ -23,9 +24,20 @@ class LightningNode(polyinterface.Node):
             {'driver': 'ST', 'value': 0, 'uom': 25},  # Strikes
             {'driver': 'GV0', 'value': 0, 'uom': 83},  # Distance
             ]
+    quantities = {'ST': None, 'GV0': 'distance'}
+    convert = conversion.converters(quantities, 'km')
+
+    def __init__(self, controller, primary, address, name):
+        # Strikes reported by evt_strike packets that haven't been
+        # covered by an observation yet, as (epoch, distance, energy).
+        self.pending = set()
+        self.last_obs = 0
+        self.last_strike = 0
+        super(LightningNode, self).__init__(controller, primary, address, name)
 
     def SetUnits(self, u):
         self.units = u
+        self.convert = conversion.converters(self.quantities, u)
         if (u == 'km'):
             self.drivers[0]['uom'] = 25
             self.drivers[1]['uom'] = 83
@@ -36,12 +48,33 @@ class LightningNode(polyinterface.Node):
             self.id = 'lightningUK'
 
     def setDriver(self, driver, value):
-        if (driver == 'GV0'):
-            if (self.units != 'km'):
-                value = round(value / 1.609344, 1)
-        super(LightningNode, self).setDriver(driver, value, report=True, force=True)
+        self.controller.publisher.publish(self, driver, self.convert[driver](value))
+
+    # Called for each evt_strike packet.  The strike count and distance
+    # are updated right away.  The count is for the current observation
+    # interval and is replaced, not added to, when the observation for
+    # that interval arrives.
+    def strike(self, ts, ld, energy=None):
+        strike = (ts, ld, energy)
+        if ts <= self.last_obs or strike in self.pending:
+            # already counted by an observation or a duplicate event
+            return
+
+        self.pending.add(strike)
+        self.setDriver('ST', len(self.pending))
+        if ts >= self.last_strike:
+            # an older strike arriving late doesn't replace the distance
+            self.last_strike = ts
+            self.setDriver('GV0', ld)
+
+    def update(self, ls, ld, ts=None):
+        if ts is not None:
+            if ts > self.last_obs:
+                self.last_obs = ts
+            if self.pending:
+                # strikes up to ts are included in this observation
+                self.pending = set(s for s in self.pending if s[0] > ts)
 
-    def update(self, ls, ld):
         self.setDriver('ST', ls)
         self.setDriver('GV0', ld)
 
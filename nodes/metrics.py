@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for WeatherFlow Weather Station data.
+Copyright (c) 2018,2019 Robert Paauwe
+
+Per packet timing of the UDP processing path.  Each handled packet is
+split in to stages and the time spent in each is added to a histogram
+kept per packet type.
+
+  decode   - json decode of the datagram
+  dispatch - the whole handler call, includes the three below
+  compute  - derived values, sea level pressure, dewpoint, etc.
+  publish  - node updates (setDriver)
+  persist  - saving the rain totals
+
+When disabled, start() returns 0 and stop()/commit() return right
+away so the cost is a couple of method calls per stage.
+
+usage:
+    t = metrics.start()
+    ...
+    metrics.stop(metrics.COMPUTE, t)
+    ...
+    metrics.commit('obs_st')
+"""
+import time
+import threading
+
+STAGES = ('decode', 'dispatch', 'compute', 'publish', 'persist')
+(DECODE, DISPATCH, COMPUTE, PUBLISH, PERSIST) = range(len(STAGES))
+
+# histogram bucket upper bounds in microseconds, the last bucket
+# catches everything slower.
+BUCKETS = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000,
+        50000, 100000)
+
+
+class Histogram(object):
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, us):
+        i = 0
+        while i < len(BUCKETS) and us > BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, pct):
+        """
+            Upper bound of the bucket holding the pct percentile,
+            capped at the largest value seen.
+        """
+        if self.count == 0:
+            return 0
+        want = self.count * pct / 100.0
+        seen = 0
+        for i in range(len(self.buckets)):
+            seen += self.buckets[i]
+            if seen >= want:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+
+class Metrics(object):
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.types = {}     # packet type -> [Histogram per stage]
+        self.current = [0.0] * len(STAGES)
+
+    def start(self):
+        if not self.enabled:
+            return 0
+        return time.perf_counter()
+
+    def stop(self, stage, start):
+        if start:
+            self.current[stage] += time.perf_counter() - start
+
+    def commit(self, ptype):
+        """
+            Add the stage times collected since the last commit to the
+            histograms for ptype.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            hists = self.types.get(ptype)
+            if hists is None:
+                hists = [Histogram() for s in STAGES]
+                self.types[ptype] = hists
+            for stage in range(len(STAGES)):
+                if self.current[stage]:
+                    hists[stage].add(self.current[stage] * 1e6)
+                    self.current[stage] = 0.0
+
+    def reset(self):
+        with self.lock:
+            self.types = {}
+            self.current = [0.0] * len(STAGES)
+
+    def summary(self):
+        """
+            Returns (packets, mean handling time in ms) over all types.
+        """
+        packets = 0
+        total = 0.0
+        with self.lock:
+            for hists in self.types.values():
+                packets += hists[DISPATCH].count
+                total += hists[DISPATCH].total
+        return (packets, total / packets / 1000 if packets else 0)
+
+    def dump(self):
+        """
+            Returns a list of report lines, one per packet type and stage.
+        """
+        lines = ['%-13s %-8s %8s %9s %9s %9s %9s' % ('type', 'stage',
+            'count', 'mean us', 'p50 us', 'p99 us', 'max us')]
+        with self.lock:
+            for ptype in sorted(self.types):
+                hists = self.types[ptype]
+                for stage in range(len(STAGES)):
+                    h = hists[stage]
+                    if h.count == 0:
+                        continue
+                    lines.append('%-13s %-8s %8d %9.1f %9.1f %9.1f %9.1f' % (
+                        ptype, STAGES[stage], h.count, h.mean(),
+                        h.percentile(50), h.percentile(99), h.max))
+        return lines
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for WeatherFlow Weather Station data.
+Copyright (c) 2018,2019 Robert Paauwe
+
+Calendar periods (hour, day, week, month, year) in the station's time
+zone.  The start and end epochs of the current periods are computed
+when an hour boundary is crossed, so placing a timestamp is normally
+two integer compares instead of a datetime.now() per period.
+
+Boundaries come from the local calendar so days are 23 or 25 hours
+long across DST changes.  Weeks are ISO weeks, starting on Monday.
+
+A timestamp older than the current hour (a late or re-ordered packet)
+doesn't move anything back, it's just reported as belonging to the
+longer periods it still falls in.
+
+usage:
+    cal = periods.Calendar(periods.zone('America/Denver'))
+    (rolled, included) = cal.advance(1588948614)
+"""
+import polyinterface
+import datetime
+
+try:
+    import zoneinfo
+except ImportError:
+    zoneinfo = None
+
+LOGGER = polyinterface.LOGGER
+
+PERIODS = ('hour', 'day', 'week', 'month', 'year')
+
+
+def zone(name):
+    """
+        tzinfo for a time zone name like 'America/Denver'.  None, which
+        means the system's local time, if there's no name or the zone
+        database isn't available.
+    """
+    if name is None or name == '' or zoneinfo is None:
+        return None
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except Exception as e:
+        LOGGER.error('Unknown time zone ' + str(name) + ', using local time')
+        return None
+
+
+def local_date(ts, tz=None):
+    return datetime.datetime.fromtimestamp(ts, tz).date()
+
+
+def midnight(day, tz=None):
+    """ Epoch of the midnight that starts day. """
+    return datetime.datetime.combine(day, datetime.time(0),
+            tzinfo=tz).timestamp()
+
+
+def boundaries(ts, tz=None):
+    """
+        Returns (starts, ends, keys) for the periods holding ts.  keys
+        are the hour, day of month, ISO week, month and year numbers.
+    """
+    dt = datetime.datetime.fromtimestamp(ts, tz)
+    day = dt.date()
+    hour = ts - (dt.minute * 60 + dt.second + dt.microsecond / 1000000.0)
+    week = day - datetime.timedelta(days=day.weekday())
+    month = day.replace(day=1)
+    next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+    year = datetime.date(day.year, 1, 1)
+
+    starts = (hour, midnight(day, tz), midnight(week, tz),
+            midnight(month, tz), midnight(year, tz))
+    ends = (hour + 3600,
+            midnight(day + datetime.timedelta(days=1), tz),
+            midnight(week + datetime.timedelta(days=7), tz),
+            midnight(next_month, tz),
+            midnight(datetime.date(day.year + 1, 1, 1), tz))
+    keys = {
+            'hour': dt.hour,
+            'day': day.day,
+            'week': day.isocalendar()[1],
+            'month': day.month,
+            'year': day.year,
+            }
+    return (starts, ends, keys)
+
+
+class Calendar(object):
+    def __init__(self, tz=None):
+        self.tz = tz
+        self.starts = None
+        self.ends = None
+        self.keys = None
+
+    def set_time(self, ts):
+        (self.starts, self.ends, self.keys) = boundaries(ts, self.tz)
+
+    def advance(self, ts):
+        """
+            Move the current periods forward to hold ts.  Returns
+            (rolled, included).  rolled maps each period that ended to
+            True if the new period directly follows the old one (False
+            when whole periods were skipped).  included lists the
+            periods ts falls in, all of them unless ts is late.
+        """
+        if self.starts is None:
+            self.set_time(ts)
+            return ({}, PERIODS)
+
+        if ts < self.ends[0]:
+            if ts >= self.starts[0]:
+                return ({}, PERIODS)
+            return ({}, tuple(PERIODS[i] for i in range(len(PERIODS))
+                if ts >= self.starts[i]))
+
+        old_ends = self.ends
+        self.set_time(ts)
+        rolled = {}
+        for i in range(len(PERIODS)):
+            if ts >= old_ends[i]:
+                rolled[PERIODS[i]] = (old_ends[i] == self.starts[i])
+        return (rolled, PERIODS)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for WeatherFlow Weather Station data.
+Copyright (c) 2018,2019 Robert Paauwe
+
+Write-behind saving of the custom data (rain totals, daily statistics).
+Updates only mark the data dirty; it's sent to Polyglot when it's dirty
+and at least min_interval seconds have passed since the last save, and
+always on shutdown.
+
+So nothing is lost if the node server dies between saves, changes that
+matter (rain was added or a period rolled over) are also written to a
+local journal file.  The journal is replaced atomically (write to a
+temporary file, fsync, rename) so it's always either the old or the new
+copy.  At startup the journal is used in place of the Polyglot copy if
+it's newer.  Each save stamps the data with its time ('saved') to tell
+which copy is newer.
+
+Saves serialize the data under saver.lock, code that changes the data
+from another thread holds the same lock.
+
+usage:
+    saver = persist.WriteBehind(data, poly.saveCustomData, 300)
+    saver.mark(journal=True)
+    ...
+    saver.tick()            # from a poll, saves if due
+    saver.flush()           # on shutdown
+"""
+import polyinterface
+import os
+import json
+import time
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+JOURNAL = 'rain_journal.json'
+
+
+def read_journal(path=JOURNAL):
+    """
+        Returns (time, data) from the journal or None.
+    """
+    if not path:
+        return None
+    try:
+        with open(path, 'r') as f:
+            journal = json.load(f)
+        return (journal['time'], journal['data'])
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        LOGGER.error('Ignoring unreadable journal ' + path + ': ' + str(e))
+        return None
+
+
+class WriteBehind(object):
+    def __init__(self, data, save, min_interval=300, journal=JOURNAL):
+        self.lock = threading.Lock()
+        self.data = data
+        self.save = save
+        self.min_interval = min_interval
+        self.journal = journal
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self.flushes = 0
+        self.bytes = 0
+        self.journal_writes = 0
+        self.journal_bytes = 0
+        self.marks = 0
+
+    def mark(self, journal=False):
+        """
+            The data changed.  journal=True for changes that must
+            survive a crash.  Saves if it's due.
+        """
+        with self.lock:
+            self.dirty = True
+            self.marks += 1
+            if journal and self.journal:
+                self.write_journal()
+        self.tick()
+
+    def tick(self):
+        if self.dirty and time.monotonic() - self.last_save >= self.min_interval:
+            self.flush()
+
+    def flush(self, force=False):
+        """
+            Save now if dirty (or force).  Returns True if saved.
+        """
+        with self.lock:
+            if not (self.dirty or force):
+                return False
+            self.data['saved'] = time.time()
+            try:
+                size = len(json.dumps(self.data))
+                self.save(self.data)
+            except Exception as e:
+                LOGGER.error('Failed to save custom data: ' + str(e))
+                return False
+            self.dirty = False
+            self.last_save = time.monotonic()
+            self.flushes += 1
+            self.bytes += size
+            return True
+
+    def write_journal(self):
+        tmp = self.journal + '.tmp'
+        try:
+            text = json.dumps({'time': time.time(), 'data': self.data})
+            with open(tmp, 'w') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.journal)
+            self.journal_writes += 1
+            self.journal_bytes += len(text)
+        except Exception as e:
+            LOGGER.error('Failed to write journal ' + self.journal + ': ' + str(e))
+
+    def stats(self):
+        return {
+                'marks': self.marks,
+                'flushes': self.flushes,
+                'bytes': self.bytes,
+                'journal_writes': self.journal_writes,
+                'journal_bytes': self.journal_bytes,
+                }
@@ -12,9 +12,115 @@ import json
 import socket
 import math
 import threading
+from nodes import conversion
 
 LOGGER = polyinterface.LOGGER
 
+# 3 hour pressure change, in mb, that starts each tendency category.
+# Falling very rapidly (0) ... steady (4) ... rising very rapidly (8).
+TENDENCY_STEPS = (0.1, 1.6, 3.6, 6.1)
+
+# Sea level reduction.  The exponents only depend on these constants and
+# the elevation term only on the station height, so both are computed
+# once (the elevation term per station, see station.StationContext)
+# instead of for every packet.
+GAS = 287.05        # gas constant for dry air
+GRAVITY = 9.80665   # gravity
+LAPSE = 0.0065      # standard atmosphere lapse rate
+SEA_LEVEL = 1013.35 # pressure at sealevel
+SEA_TEMP = 288.15   # sea level temperature
+
+EXP_L = GRAVITY / (GAS * LAPSE)
+EXP_C = GAS * LAPSE / GRAVITY
+SEA_LEVEL_C = math.pow(SEA_LEVEL, EXP_C)
+
+
+def elevation_term(elevation):
+    return LAPSE * elevation / SEA_TEMP
+
+
+def sea_level(station, term):
+    """
+        Station pressure in millibars to sealevel pressure.  term is
+        elevation_term() of the station height.
+    """
+    if station is None:
+        return 0
+
+    try:
+        st = station * 1.0
+        u = math.pow(1 + SEA_LEVEL_C * math.pow(st, -EXP_C) * term, EXP_L)
+        return round(st * u, 3)
+    except Exception as e:
+        LOGGER.error('Pressure conversion failed: ' + str(e))
+        return station
+
+
+class PressureTrend(object):
+    """
+        Station pressure history in a fixed size ring buffer with one
+        slot per resolution seconds, indexed by timestamp.  Adding a
+        sample and looking up the pressure at some time in the past
+        only touch a few slots, no matter how much history there is.
+
+        Lookups take the sample closest to the wanted time, within
+        tolerance seconds, so gaps and irregular report intervals are
+        fine.  If there's nothing close enough the change is unknown
+        (None).
+    """
+    def __init__(self, resolution=60, span=3 * 3600, tolerance=300):
+        self.resolution = resolution
+        self.tolerance = tolerance
+        self.reach = int(tolerance // resolution) + 1
+        self.size = int(span // resolution) + 2 * self.reach + 1
+        self.times = [None] * self.size
+        self.values = [0.0] * self.size
+        self.latest = None
+
+    def add(self, ts, p):
+        slot = int(ts // self.resolution) % self.size
+        self.times[slot] = ts
+        self.values[slot] = p
+        if self.latest is None or ts >= self.latest[0]:
+            self.latest = (ts, p)
+
+    def at(self, ts):
+        """
+            Returns (time, pressure) of the sample closest to ts or None.
+        """
+        base = int(ts // self.resolution)
+        best = None
+        for k in range(-self.reach, self.reach + 1):
+            t = self.times[(base + k) % self.size]
+            if t is None or abs(t - ts) > self.tolerance:
+                continue
+            if best is None or abs(t - ts) < abs(best[0] - ts):
+                best = (t, self.values[(base + k) % self.size])
+        return best
+
+    def change(self, seconds):
+        """
+            Returns (change, rate per hour) over the last seconds or
+            (None, None).
+        """
+        if self.latest is None:
+            return (None, None)
+        then = self.at(self.latest[0] - seconds)
+        if then is None or then[0] >= self.latest[0]:
+            return (None, None)
+        delta = self.latest[1] - then[1]
+        return (delta, delta * 3600.0 / (self.latest[0] - then[0]))
+
+    def tendency(self, change_3h):
+        if change_3h is None:
+            return 4
+        step = 0
+        for limit in TENDENCY_STEPS:
+            if abs(change_3h) >= limit:
+                step += 1
+        return 4 + step if change_3h > 0 else 4 - step
+
+
 class PressureNode(polyinterface.Node):
     id = 'pressure'
     hint = [1,11,3,0]
@@ -22,98 +128,99 @@ class PressureNode(polyinterface.Node):
     drivers = [
             {'driver': 'ST', 'value': 0, 'uom': 117},  # abs (station) press
             {'driver': 'GV0', 'value': 0, 'uom': 117}, # rel (sealevel) press
-            {'driver': 'GV1', 'value': 0, 'uom': 25}  # trend
+            {'driver': 'GV1', 'value': 0, 'uom': 25},  # trend
+            {'driver': 'GV2', 'value': 0, 'uom': 117}, # 3 hour change
+            {'driver': 'GV3', 'value': 0, 'uom': 117}, # change per hour
+            {'driver': 'GV4', 'value': 4, 'uom': 25},  # tendency
+            {'driver': 'GV5', 'value': 0, 'uom': 117}, # high today (sealevel)
+            {'driver': 'GV6', 'value': 0, 'uom': 117}, # low today
+            {'driver': 'GV7', 'value': 0, 'uom': 117}, # mean today
+            {'driver': 'GV8', 'value': 0, 'uom': 117}, # high yesterday
+            {'driver': 'GV9', 'value': 0, 'uom': 117}, # low yesterday
+            {'driver': 'GV10', 'value': 0, 'uom': 117} # mean yesterday
             ]
-    mytrend = []
+    quantities = {'ST': 'pressure', 'GV0': 'pressure', 'GV1': None,
+            'GV2': 'pressure', 'GV3': 'pressure', 'GV4': None,
+            'GV5': 'pressure', 'GV6': 'pressure', 'GV7': 'pressure',
+            'GV8': 'pressure', 'GV9': 'pressure', 'GV10': 'pressure'}
+    convert = conversion.converters(quantities, 'mb')
 
+    def __init__(self, controller, primary, address, name):
+        # per station pressure history
+        self.trend = PressureTrend()
+        super(PressureNode, self).__init__(controller, primary, address, name)
 
     def SetUnits(self, u):
         # can we dynmically set the drivers here also?
         # what about the ID, can we dynamically change that to change
         # the node def?
         self.units = u
+        self.convert = conversion.converters(self.quantities, u)
         if (u == 'mb'):  # millibar
             self.drivers[0]['uom'] = 117
             self.drivers[1]['uom'] = 117
+            self.drivers[3]['uom'] = 117
+            self.drivers[4]['uom'] = 117
+            for d in self.drivers[6:]:
+                d['uom'] = 117
             self.id = 'pressure'
         elif (u == 'inhg'):   # inHg
             self.drivers[0]['uom'] = 23
             self.drivers[1]['uom'] = 23
+            self.drivers[3]['uom'] = 23
+            self.drivers[4]['uom'] = 23
+            for d in self.drivers[6:]:
+                d['uom'] = 23
             self.id = 'pressureUS'
 
     # convert station pressure in millibars to sealevel pressure
     def toSeaLevel(self, station, elevation):
-        i = 287.05  # gas constant for dry air
-        a = 9.80665 # gravity
-        r = 0.0065  # standard atmosphere lapse rate
-        s = 1013.35 # pressure at sealevel
-        n = 288.15  # sea level temperature
+        return sea_level(station, elevation_term(elevation * 1.0))
+
+    # Track station pressure and calculate the trend.  Returns
+    # (trend, 3 hour change, change per hour, tendency) where trend is
+    # falling (0), steady (1) or rising (2) by more than 1mb over 3
+    # hours and tendency is the finer 0 - 8 category.  The change per
+    # hour is over the last hour.
+    def updateTrend(self, current, ts=None):
+        if current is None:
+            return (1, None, None, 4)
+        if ts is None:
+            ts = time.time()
+
+        self.trend.add(ts, current)
+        (change, rate_3h) = self.trend.change(3 * 3600)
+        (change_1h, rate) = self.trend.change(3600)
+        LOGGER.debug('TREND 3h %s 1h %s rate %s' % (change, change_1h, rate))
 
-        if station is None:
-            return 0
-
-        el = elevation * 1.0
-        st = station * 1.0
-
-        try:
-            l = a / (i * r)
-
-            c = i * r / a
-
-            u = math.pow(1 + math.pow(s / st, c) * (r * el / n), l)
-
-            slp = (round((st * u), 3))
-        except Exception as e:
-            LOGGER.error('Pressure conversion failed: ' + str(e.msg))
-            slp = station
-
-        return slp
-
-    # track pressures in a queue and calculate trend
-    def updateTrend(self, current):
         t = 1  # Steady
-        past = 0
-
-        if len(self.mytrend) > 1:
-            LOGGER.info('LAST entry = %f' % self.mytrend[-1])
-        if len(self.mytrend) == 180:
-            # This should be poping the last entry on the list (or the 
-            # oldest item added to the list).
-            past = self.mytrend.pop()
-
-        if self.mytrend != []:
-            # mytrend[0] seems to be the last entry inserted, not
-            # the first.  So how do we get the last item from the
-            # end of the array -- mytrend[-1]
-            past = self.mytrend[-1]
-
-        # calculate trend
-        try:
-            LOGGER.info('TREND %f to %f' % (past, current))
-            if ((past - current) > 1):
+        if change is not None:
+            if change < -1:
                 t = 0 # Falling
-            elif ((past - current) < -1):
+            elif change > 1:
                 t = 2 # Rising
 
-            # inserts the value at index 0 and bumps all existing entries
-            # up by one index
-            self.mytrend.insert(0, current)
-        except:
-            LOGGER.error('Pressure value invalid. Trend not calculated.')
-
-        return t
+        return (t, change, rate, self.trend.tendency(change))
 
     # We want to override the SetDriver method so that we can properly
     # convert the units based on the user preference.
     def setDriver(self, driver, value):
         if (value is not None):
-            if (self.units == 'inhg' and driver != 'GV1' ):
-                value = round(value * 0.02952998751, 3)
-            super(PressureNode, self).setDriver(driver, value, report=True, force=True)
+            self.controller.publisher.publish(self, driver, self.convert[driver](value))
 
     def update(self, p, sl, trend):
-        self.setDriver('ST', p)
-        self.setDriver('GV0', sl)
-        self.setDriver('GV1', trend)
+        (t, change, rate, tendency) = trend
+        for (driver, value) in conversion.convert_vector(self.convert,
+                ('ST', 'GV0', 'GV1', 'GV2', 'GV3', 'GV4'),
+                (p, sl, t, change, rate, tendency)):
+            if value is not None:
+                self.controller.publisher.publish(self, driver, value)
+
+    # (high, low, mean) today and yesterday from daily.DailyStats
+    def update_daily(self, values):
+        for (driver, value) in conversion.convert_vector(self.convert,
+                ('GV5', 'GV6', 'GV7', 'GV8', 'GV9', 'GV10'), values):
+            if value is not None:
+                self.controller.publisher.publish(self, driver, value)
 
 
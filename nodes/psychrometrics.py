@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for WeatherFlow Weather Station data.
+Copyright (c) 2018,2019 Robert Paauwe
+
+Derived temperature metrics.  Feels like (apparent) temperature, dew
+point, heat index, wind chill, wet-bulb temperature and air density
+are all computed in one pass from temperature (C), relative humidity
+(%), wind speed (kph) and station pressure (mb), sharing the
+intermediate terms.
+
+  derive()       - one observation, plain math.  Used for live packets.
+  derive_array() - arrays of observations using NumPy, for backfill and
+                   rollups.  Falls back to derive() in a loop when NumPy
+                   isn't installed.
+
+Both return (feels like, dew point, heat index, wind chill, wet-bulb,
+air density).  Temperatures are in C rounded to 0.1, density in kg/m3
+rounded to 0.001.
+
+usage:
+    (fl, dp, hi, wc, wb, ad) = psychrometrics.derive(22.4, 50.3, 7.9, 1017.6)
+"""
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+RD = 287.058    # gas constant for dry air, J/(kg K)
+RV = 461.495    # gas constant for water vapor, J/(kg K)
+
+
+def derive(t, h, ws, p=None):
+    """
+        Derived metrics for a single observation.  Air density needs
+        the station pressure and is None without it.
+    """
+    rh = h / 100.0
+    tf = (t * 1.8) + 32
+    mph = ws / 1.609
+
+    # vapor pressure (mb), also used for density
+    e = rh * 6.105 * math.exp(17.27 * t / (237.7 + t))
+
+    # apparent temperature, Australian BoM.  wants m/s
+    fl = round(t + (0.33 * e) - (0.70 * ws / 3.6) - 4.0, 1)
+
+    # dew point, Magnus
+    if rh <= 0:
+        dp = 0
+    else:
+        b = (17.625 * t) / (243.04 + t)
+        c = math.log(rh)
+        dp = round((243.04 * (c + b)) / (17.625 - c - b), 1)
+
+    # heat index, NWS Rothfusz regression.  Only above 80F and 40%
+    if tf < 80.0 or h < 40.0:
+        hi = t
+    else:
+        hi = (-42.379 + (2.04901523 * tf) + (10.1433127 * h) +
+                (-0.22475541 * tf * h) + (-6.83783e-3 * tf * tf) +
+                (-5.481717e-2 * h * h) + (1.22874e-3 * tf * tf * h) +
+                (8.5282e-4 * tf * h * h) + (-1.99e-6 * tf * tf * h * h))
+        hi = round((hi - 32) / 1.8, 1)
+
+    # wind chill, NWS.  Only at or below 50F with 5 mph or more wind
+    if tf <= 50.0 and mph >= 5.0:
+        v = math.pow(mph, 0.16)
+        wc = 35.74 + (0.6215 * tf) - (35.75 * v) + (0.4275 * tf * v)
+        wc = round((wc - 32) / 1.8, 1)
+    else:
+        wc = t
+
+    # wet-bulb, Stull (2011)
+    wb = (t * math.atan(0.151977 * math.sqrt(h + 8.313659)) +
+            math.atan(t + h) - math.atan(h - 1.676331) +
+            0.00391838 * math.pow(h, 1.5) * math.atan(0.023101 * h) -
+            4.686035)
+    wb = round(wb, 1)
+
+    # density of moist air
+    if p is None:
+        ad = None
+    else:
+        tk = t + 273.15
+        ad = round(((p - e) * 100 / (RD * tk)) + (e * 100 / (RV * tk)), 3)
+
+    return (fl, dp, hi, wc, wb, ad)
+
+
+def derive_array(t, h, ws, p=None):
+    """
+        Derived metrics for arrays of observations.  Returns a tuple of
+        arrays in the same order as derive().
+    """
+    if numpy is None:
+        if p is None:
+            p = [None] * len(t)
+        rows = [derive(*obs) for obs in zip(t, h, ws, p)]
+        return tuple(list(col) for col in zip(*rows)) if rows else ([],) * 6
+
+    np = numpy
+    t = np.asarray(t, dtype=float)
+    h = np.asarray(h, dtype=float)
+    ws = np.asarray(ws, dtype=float)
+
+    rh = h / 100.0
+    tf = (t * 1.8) + 32
+    mph = ws / 1.609
+
+    e = rh * 6.105 * np.exp(17.27 * t / (237.7 + t))
+
+    fl = np.round(t + (0.33 * e) - (0.70 * ws / 3.6) - 4.0, 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b = (17.625 * t) / (243.04 + t)
+        c = np.log(np.where(rh > 0, rh, 1.0))
+        dp = np.where(rh > 0,
+                np.round((243.04 * (c + b)) / (17.625 - c - b), 1), 0.0)
+
+    hi = (-42.379 + (2.04901523 * tf) + (10.1433127 * h) +
+            (-0.22475541 * tf * h) + (-6.83783e-3 * tf * tf) +
+            (-5.481717e-2 * h * h) + (1.22874e-3 * tf * tf * h) +
+            (8.5282e-4 * tf * h * h) + (-1.99e-6 * tf * tf * h * h))
+    hi = np.where((tf < 80.0) | (h < 40.0), t, np.round((hi - 32) / 1.8, 1))
+
+    v = np.power(mph, 0.16)
+    wc = 35.74 + (0.6215 * tf) - (35.75 * v) + (0.4275 * tf * v)
+    wc = np.where((tf <= 50.0) & (mph >= 5.0), np.round((wc - 32) / 1.8, 1), t)
+
+    wb = (t * np.arctan(0.151977 * np.sqrt(h + 8.313659)) +
+            np.arctan(t + h) - np.arctan(h - 1.676331) +
+            0.00391838 * np.power(h, 1.5) * np.arctan(0.023101 * h) -
+            4.686035)
+    wb = np.round(wb, 1)
+
+    if p is None:
+        ad = None
+    else:
+        p = np.asarray(p, dtype=float)
+        tk = t + 273.15
+        ad = np.round(((p - e) * 100 / (RD * tk)) + (e * 100 / (RV * tk)), 3)
+
+    return (fl, dp, hi, wc, wb, ad)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for WeatherFlow Weather Station data.
+Copyright (c) 2018,2019 Robert Paauwe
+
+Change suppression for node driver updates.  The last value sent for
+each node/driver is cached and a new value is only sent when it differs
+by more than the deadband for that driver, or when the driver hasn't
+been sent for max_silence seconds.
+
+Deadbands are given as a comma separated list of kind=value or
+kind.driver=value where kind is the node type without the units suffix
+(temperature, humidity, pressure, wind, precipitation, light, lightning
+or hub).  Values are in the units the node displays.  Drivers without a
+deadband are only sent when the value changes.
+
+Updates can also be batched.  Between begin() and flush() every
+publish() is staged instead of sent, a driver set more than once only
+keeps the last value, and flush() sends what's left grouped by node.
+Polyglot v2 takes one driver per status message so a batch is still a
+message per driver, just fewer of them.
+
+usage:
+    publisher = publish.Publisher('temperature=0.2,wind.GV1=2', 900)
+    publisher.begin()
+    publisher.publish(node, 'ST', value)
+    ...
+    publisher.flush()
+"""
+import polyinterface
+import time
+import weakref
+import collections
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+# node id suffixes that only select the display units
+UNIT_SUFFIXES = ('US', 'UK')
+
+
+def parse_deadbands(spec):
+    deadbands = {}
+    for item in str(spec).split(','):
+        item = item.strip()
+        if item == '':
+            continue
+        try:
+            (key, value) = item.split('=', 1)
+            key = key.strip()
+            if '.' in key:
+                (kind, driver) = key.split('.', 1)
+                key = (kind.strip().lower(), driver.strip().upper())
+            else:
+                key = (key.lower(), None)
+            deadbands[key] = abs(float(value))
+        except ValueError:
+            LOGGER.error('Invalid deadband ' + item + ', ignoring')
+    return deadbands
+
+
+def node_kind(node):
+    kind = node.id
+    for suffix in UNIT_SUFFIXES:
+        if kind.endswith(suffix):
+            kind = kind[:-len(suffix)]
+    return kind.rstrip('0123456789').lower()
+
+
+class Publisher(object):
+    def __init__(self, deadbands='', max_silence=900):
+        self.lock = threading.Lock()
+        # node -> {driver: [value, time sent, deadband]}.  Weak so a
+        # deleted node's cache goes with it.
+        self.last = weakref.WeakKeyDictionary()
+        self.sent = 0
+        self.suppressed = 0
+        self.batches = 0
+        self.staged = 0
+        self.batch_sent = 0
+        self.local = threading.local()
+        self.configure(deadbands, max_silence)
+
+    def configure(self, deadbands, max_silence):
+        """
+            max_silence of 0 turns suppression off, every update is
+            sent.
+        """
+        with self.lock:
+            self.deadbands = parse_deadbands(deadbands)
+            self.max_silence = max(0, float(max_silence))
+            self.last = weakref.WeakKeyDictionary()
+
+    def deadband(self, node, driver):
+        kind = node_kind(node)
+        return self.deadbands.get((kind, driver),
+                self.deadbands.get((kind, None), 0))
+
+    def changed(self, node, driver, value):
+        """
+            Returns True if value should be sent.  The value is then
+            remembered as the last one sent.
+        """
+        now = time.monotonic()
+        with self.lock:
+            drivers = self.last.get(node)
+            if drivers is None:
+                drivers = {}
+                self.last[node] = drivers
+            last = drivers.get(driver)
+            if last is None:
+                drivers[driver] = [value, now, self.deadband(node, driver)]
+                self.sent += 1
+                return True
+
+            if self.max_silence > 0 and now - last[1] < self.max_silence:
+                try:
+                    same = abs(value - last[0]) <= last[2]
+                except TypeError:
+                    same = (value == last[0])
+                if same:
+                    self.suppressed += 1
+                    return False
+
+            last[0] = value
+            last[1] = now
+            self.sent += 1
+            return True
+
+    def send(self, node, driver, value):
+        if self.changed(node, driver, value):
+            polyinterface.Node.setDriver(node, driver, value, report=True,
+                    force=True)
+            return True
+        return False
+
+    def publish(self, node, driver, value):
+        batch = getattr(self.local, 'batch', None)
+        if batch is None:
+            self.send(node, driver, value)
+            return
+        drivers = batch.get(node)
+        if drivers is None:
+            drivers = collections.OrderedDict()
+            batch[node] = drivers
+        drivers[driver] = value
+        self.staged += 1
+
+    def begin(self):
+        # batches are per thread
+        self.local.batch = collections.OrderedDict()
+
+    def flush(self):
+        batch = getattr(self.local, 'batch', None)
+        self.local.batch = None
+        if not batch:
+            return
+        sent = 0
+        for node in batch:
+            for (driver, value) in batch[node].items():
+                if self.send(node, driver, value):
+                    sent += 1
+        self.batches += 1
+        self.batch_sent += sent
+
+    def stats(self):
+        return {
+                'sent': self.sent,
+                'suppressed': self.suppressed,
+                'batches': self.batches,
+                # driver updates per observation before and after
+                # batching and suppression
+                'staged_per_batch': self.staged / self.batches if self.batches else 0,
+                'sent_per_batch': self.batch_sent / self.batches if self.batches else 0,
+                }
@@ -12,9 +12,20 @@ import json
 import socket
 import math
 import threading
+from nodes import conversion
+from nodes import periods
 
 LOGGER = polyinterface.LOGGER
 
+# accumulation attribute for each calendar period
+PERIOD_TOTALS = {
+        'hour': 'hourly_rain',
+        'day': 'daily_rain',
+        'week': 'weekly_rain',
+        'month': 'monthly_rain',
+        'year': 'yearly_rain',
+        }
+
 class PrecipitationNode(polyinterface.Node):
     id = 'precipitation'
     hint = [1,11,5,0]
@@ -26,8 +37,12 @@ class PrecipitationNode(polyinterface.Node):
             {'driver': 'GV2', 'value': 0, 'uom': 82}, # weekly
             {'driver': 'GV3', 'value': 0, 'uom': 82}, # monthly
             {'driver': 'GV4', 'value': 0, 'uom': 82}, # yearly
-            {'driver': 'GV5', 'value': 0, 'uom': 82}  # yesterday
+            {'driver': 'GV5', 'value': 0, 'uom': 82}, # yesterday
+            {'driver': 'GV6', 'value': 0, 'uom': 2}   # raining
             ]
+    quantities = {'ST': 'rain', 'GV0': 'rain', 'GV1': 'rain', 'GV2': 'rain',
+            'GV3': 'rain', 'GV4': 'rain', 'GV5': 'rain', 'GV6': None}
+    convert = conversion.converters(quantities, 'mm')
     hourly_rain = 0
     daily_rain = 0
     weekly_rain = 0
@@ -35,13 +50,9 @@ class PrecipitationNode(polyinterface.Node):
     yearly_rain = 0
     yesterday_rain = 0
 
-    prev_hour = 0
-    prev_day = 0
-    prev_week = 0
-    prev_month = 0
-    prev_year = 0
+    calendar = None
 
-    def InitializeRain(self, acc):
+    def InitializeRain(self, acc, tz=None):
         self.daily_rain = acc['daily']
         self.hourly_rain = acc['hourly']
         self.weekly_rain = acc['weekly']
@@ -49,48 +60,40 @@ class PrecipitationNode(polyinterface.Node):
         self.yearly_rain = acc['yearly']
         self.yesterday_rain = acc['yesterday']
 
-        self.prev_hour = acc['hour']
-        self.prev_day = acc['day']
-        self.prev_week = acc['week']
-        self.prev_month = acc['month']
-        self.prev_year = acc['year']
-
-        now = datetime.datetime.now()
+        # The saved totals are checked against the clock here, after
+        # that the periods follow the observation times starting with
+        # the first one.
+        now = periods.boundaries(time.time(), tz)[2]
+        self.calendar = periods.Calendar(tz)
 
         # Need to compare saved date with current date and clear out 
         # any accumlations that are old.
 
-        current_hour = now.hour
-        if self.prev_hour != now.hour:
+        if acc['hour'] != now['hour']:
             LOGGER.info('Clearing old hourly data')
-            self.prev_hour = now.hour
             self.hourly_rain = 0
 
-        if self.prev_day != now.day:
+        if acc['day'] != now['day']:
             LOGGER.info('Clearing old daily, hourly data')
             self.yesterday_rain = self.daily_rain
-            self.prev_day = now.day
             self.hourly_rain = 0
             self.daily_rain = 0
 
-        if self.prev_week != now.isocalendar()[1]:
+        if acc.get('week') != now['week']:
             LOGGER.info('Clearing old weekly, daily, hourly data')
-            self.prev_week = now.isocalendar()[1]
             self.hourly_rain = 0
             self.daily_rain = 0
             self.weekly_rain = 0
 
-        if self.prev_month != now.month:
+        if acc['month'] != now['month']:
             LOGGER.info('Clearing old monthly, daily, hourly data')
-            self.prev_month = now.month
             self.hourly_rain = 0
             self.daily_rain = 0
             self.weekly_rain = 0
             self.monthly_rain = 0
 
-        if self.prev_year != now.year:
+        if acc['year'] != now['year']:
             LOGGER.info('Clearing old yearly, monthly, daily, hourly data')
-            self.prev_year = now.year
             self.hourly_rain = 0
             self.daily_rain = 0
             self.weekly_rain = 0
@@ -98,8 +101,17 @@ class PrecipitationNode(polyinterface.Node):
             self.yearly_rain = 0
 
 
+    # evt_precip, rain has started.  Cleared by the first observation
+    # that reports no rain.
+    def rain_start(self):
+        self.raining(1)
+
+    def raining(self, state):
+        self.controller.publisher.publish(self, 'GV6', state)
+
     def SetUnits(self, u):
         self.units = u
+        self.convert = conversion.converters(self.quantities, u)
         if (u == 'mm'):
             self.drivers[0]['uom'] = 46
             self.drivers[1]['uom'] = 82
@@ -119,60 +131,22 @@ class PrecipitationNode(polyinterface.Node):
             self.drivers[6]['uom'] = 105
             self.id = 'precipitationUS'
 
-    def hourly_accumulation(self, r):
-        current_hour = datetime.datetime.now().hour
-        if (current_hour != self.prev_hour):
-            self.prev_hour = current_hour
-            self.hourly_rain = 0
-
-        self.hourly_rain += r
-        return self.hourly_rain
-
-    def daily_accumulation(self, r):
-        current_day = datetime.datetime.now().day
-        if (current_day != self.prev_day):
-            self.yesterday_rain = self.daily_rain
-            self.prev_day = current_day
-            self.daily_rain = 0
-
-        self.daily_rain += r
-        return self.daily_rain
-
-    def yesterday_accumulation(self):
-        return self.yesterday_rain
-
-    def weekly_accumulation(self, r):
-        (y, w, d) = datetime.datetime.now().isocalendar()
-        if w != self.prev_week:
-            self.prev_week = w
-            self.weekly_rain = 0
-
-        self.weekly_rain += r
-        return self.weekly_rain
-
-    def monthly_accumulation(self, r):
-        current_month = datetime.datetime.now().month
-        if (current_month != self.prev_month):
-            self.prev_month = current_month
-            self.monthly_rain = 0
-
-        self.monthly_rain += r
-        return self.monthly_rain
-
-    def yearly_accumulation(self, r):
-        current_year = datetime.datetime.now().year
-        if (current_year != self.prev_year):
-            self.prev_year = current_year
-            self.yearly_rain = 0
-
-        self.yearly_rain += r
-        return self.yearly_rain
+    # Add rain from an observation with packet time ts.  Totals for
+    # periods that ended are cleared first, a late observation is only
+    # added to the periods it falls in.  Returns True if any total
+    # changed.
+    def accumulate(self, r, ts):
+        (rolled, included) = self.calendar.advance(ts)
+        if 'day' in rolled:
+            self.yesterday_rain = self.daily_rain if rolled['day'] else 0
+        for period in rolled:
+            setattr(self, PERIOD_TOTALS[period], 0)
+        if r:
+            for period in included:
+                name = PERIOD_TOTALS[period]
+                setattr(self, name, getattr(self, name) + r)
+        return bool(rolled) or (bool(r) and len(included) > 0)
 
-        
     def setDriver(self, driver, value):
-        if (self.units == 'in'):
-            value = round(value * 0.03937, 2)
-        else:
-            value = round(value, 3)
-        super(PrecipitationNode, self).setDriver(driver, value, report=True, force=True)
+        self.controller.publisher.publish(self, driver, self.convert[driver](value))
 
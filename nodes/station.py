@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Polyglot v2 node server for WeatherFlow Weather Station data.
+Copyright (c) 2018,2019 Robert Paauwe
+
+Per station state.  The controller can monitor several stations, each
+one gets a Station object holding its devices, its group of nodes and
+the state used to process its packets (last wind speed, wind averages,
+rain accumulations, daily statistics).  Duplicate packets are dropped
+by the controller before they get here.
+
+The first station keeps the original node addresses ('temperature',
+'rain', 'hub', ...) so existing installs don't see their nodes change.
+Nodes for the other stations get a 's<n>' address prefix.
+
+Values that only change when the station is discovered or configured
+(height, sea level reduction factor) are kept in an immutable
+StationContext so the packet handlers just read attributes.
+"""
+import polyinterface
+import datetime
+import collections
+from nodes import pressure
+
+LOGGER = polyinterface.LOGGER
+
+
+def parse_ids(value):
+    """
+        The Station parameter may hold a single station ID or a comma
+        separated list of them.
+    """
+    return [s.strip() for s in str(value).split(',') if s.strip() != '']
+
+
+def new_rain_data(station_id=''):
+    now = datetime.datetime.now()
+    return {
+            'hourly': 0,
+            'hour': now.hour,
+            'daily': 0,
+            'day': now.day,
+            'weekly': 0,
+            'week': now.isocalendar()[1],
+            'monthly': 0,
+            'month': now.month,
+            'yearly': 0,
+            'year': now.year,
+            'yesterday': 0,
+            'station': station_id,
+            }
+
+
+class StationContext(collections.namedtuple('StationContext',
+        ('id', 'elevation', 'agl', 'height', 'slp_term'))):
+    """
+        Per station constants.  Build a new one with Station.set_location()
+        when the elevation or AGL changes, never modify it.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, station_id, elevation, agl):
+        height = elevation + agl
+        return cls(station_id, elevation, agl, height,
+                pressure.elevation_term(height))
+
+    def sea_level(self, p):
+        return pressure.sea_level(p, self.slp_term)
+
+
+class Station(object):
+    def __init__(self, station_id, index):
+        self.id = str(station_id)
+        self.index = index
+        if index == 0:
+            self.prefix = ''
+        else:
+            self.prefix = 's{}'.format(index + 1)
+
+        self.devices = []
+        self.air_sn = ''
+        self.sky_sn = ''
+        self.tempest_sn = ''
+        self.tempest = False
+        self.device_id = None
+        self.elevation = 0.0
+        self.agl = 0.0
+        self.context = StationContext.build(self.id, 0.0, 0.0)
+        self.timezone = None    # IANA name from the WF servers
+
+        self.nodes = {}
+        self.rain_data = None
+        self.rapid_wind = None
+        self.wind_engine = None
+        self.windspeed = 0
+        self.daily = None
+        self.daily_extremes = None  # as of the last marked save
+
+    def set_location(self, elevation=None, agl=None):
+        if elevation is not None:
+            self.elevation = float(elevation)
+        if agl is not None:
+            self.agl = float(agl)
+        self.context = StationContext.build(self.id, self.elevation, self.agl)
+
+    def address(self, name):
+        return self.prefix + name
+
+    def title(self, name):
+        if self.index == 0:
+            return name
+        return 'WF ' + self.id + ' ' + name
+
+    def add_device(self, serial):
+        if serial is not None and serial != '' and serial not in self.devices:
+            self.devices.append(serial)
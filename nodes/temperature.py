@@ -12,6 +12,7 @@ import json
 import socket
 import math
 import threading
+from nodes import conversion
 
 LOGGER = polyinterface.LOGGER
 
@@ -24,17 +25,35 @@ class TemperatureNode(polyinterface.Node):
             {'driver': 'GV0', 'value': 0, 'uom': 17}, # feels like
             {'driver': 'GV1', 'value': 0, 'uom': 17}, # dewpoint
             {'driver': 'GV2', 'value': 0, 'uom': 17}, # heat index
-            {'driver': 'GV3', 'value': 0, 'uom': 17}  # windchill
+            {'driver': 'GV3', 'value': 0, 'uom': 17}, # windchill
+            {'driver': 'GV4', 'value': 0, 'uom': 17}, # wet-bulb
+            {'driver': 'GV5', 'value': 0, 'uom': 56}, # air density
+            {'driver': 'GV6', 'value': 0, 'uom': 17}, # high today
+            {'driver': 'GV7', 'value': 0, 'uom': 17}, # low today
+            {'driver': 'GV8', 'value': 0, 'uom': 17}, # mean today
+            {'driver': 'GV9', 'value': 0, 'uom': 17}, # high yesterday
+            {'driver': 'GV10', 'value': 0, 'uom': 17}, # low yesterday
+            {'driver': 'GV11', 'value': 0, 'uom': 17}  # mean yesterday
             ]
+    quantities = {'ST': 'temperature', 'GV0': 'temperature',
+            'GV1': 'temperature', 'GV2': 'temperature', 'GV3': 'temperature',
+            'GV4': 'temperature', 'GV5': None, 'GV6': 'temperature',
+            'GV7': 'temperature', 'GV8': 'temperature', 'GV9': 'temperature',
+            'GV10': 'temperature', 'GV11': 'temperature'}
+    convert = conversion.converters(quantities, 'c')
 
     def SetUnits(self, u):
         self.units = u
+        self.convert = conversion.converters(self.quantities, u)
         if (u == 'c'):  # C
             self.drivers[0]['uom'] = 4
             self.drivers[1]['uom'] = 4
             self.drivers[2]['uom'] = 4
             self.drivers[3]['uom'] = 4
             self.drivers[4]['uom'] = 4
+            self.drivers[5]['uom'] = 4
+            for d in self.drivers[7:]:
+                d['uom'] = 4
             self.id = 'temperature'
         elif (u == 'uk'):  # C
             self.drivers[0]['uom'] = 4 
@@ -42,6 +61,9 @@ class TemperatureNode(polyinterface.Node):
             self.drivers[2]['uom'] = 4
             self.drivers[3]['uom'] = 4
             self.drivers[4]['uom'] = 4
+            self.drivers[5]['uom'] = 4
+            for d in self.drivers[7:]:
+                d['uom'] = 4
             self.id = 'temperatureUK'
         elif (u == 'f'):   # F
             self.drivers[0]['uom'] = 17
@@ -49,68 +71,25 @@ class TemperatureNode(polyinterface.Node):
             self.drivers[2]['uom'] = 17
             self.drivers[3]['uom'] = 17
             self.drivers[4]['uom'] = 17
+            self.drivers[5]['uom'] = 17
+            for d in self.drivers[7:]:
+                d['uom'] = 17
             self.id = 'temperatureUS'
 
-    def Dewpoint(self, t, h):
-        b = (17.625 * t) / (243.04 + t)
-        rh = h / 100.0
-
-        if rh <= 0:
-            return 0
-
-        c = math.log(rh)
-        dewpt = (243.04 * (c + b)) / (17.625 - c - b)
-        return round(dewpt, 1)
-
-    def ApparentTemp(self, t, ws, h):
-        wv = h / 100.0 * 6.105 * math.exp(17.27 * t / (237.7 + t))
-        at =  t + (0.33 * wv) - (0.70 * ws) - 4.0
-        return round(at, 1)
-
-    def Windchill(self, t, ws):
-        # really need temp in F and speed in MPH
-        tf = (t * 1.8) + 32
-        #mph = ws / 0.44704 # from m/s to mph
-        mph = ws / 1.609  # from kph to mph
-
-        wc = 35.74 + (0.6215 * tf) - (35.75 * math.pow(mph, 0.16)) + (0.4275 * tf * math.pow(mph, 0.16))
-
-        if (tf <= 50.0) and (mph >= 5.0):
-            return round((wc - 32) / 1.8, 1)
-        else:
-            return t
-
-    def Heatindex(self, t, h):
-        tf = (t * 1.8) + 32
-        c1 = -42.379
-        c2 = 2.04901523
-        c3 = 10.1433127
-        c4 = -0.22475541
-        c5 = -6.83783 * math.pow(10, -3)
-        c6 = -5.481717 * math.pow(10, -2)
-        c7 = 1.22874 * math.pow(10, -3)
-        c8 = 8.5282 * math.pow(10, -4)
-        c9 = -1.99 * math.pow(10, -6)
-
-        hi = (c1 + (c2 * tf) + (c3 * h) + (c4 * tf * h) + (c5 * tf *tf) + (c6 * h * h) + (c7 * tf * tf * h) + (c8 * tf * h * h) + (c9 * tf * tf * h * h))
-
-        if (tf < 80.0) or (h < 40.0):
-            return t
-        else:
-            return round((hi - 32) / 1.8, 1)
-
     def setDriver(self, driver, value):
-        if (self.units == "f"):
-            value = (value * 1.8) + 32  # convert to F
-
-        super(TemperatureNode, self).setDriver(driver, round(value, 1), report=True, force=True)
-
-    # Possible TODO: do calculations here. I.E. pass in temp, ws, humidity
-    def update(self, t, fl, dp, hi, wc):
-        self.setDriver('ST', t)
-        self.setDriver('GV0', fl)
-        self.setDriver('GV1', dp)
-        self.setDriver('GV2', hi)
-        self.setDriver('GV3', wc)
-
-
+        self.controller.publisher.publish(self, driver, self.convert[driver](value))
+
+    # The derived values come from psychrometrics.derive()
+    def update(self, t, fl, dp, hi, wc, wb=None, ad=None):
+        for (driver, value) in conversion.convert_vector(self.convert,
+                ('ST', 'GV0', 'GV1', 'GV2', 'GV3', 'GV4', 'GV5'),
+                (t, fl, dp, hi, wc, wb, ad)):
+            if value is not None:
+                self.controller.publisher.publish(self, driver, value)
+
+    # (high, low, mean) today and yesterday from daily.DailyStats
+    def update_daily(self, values):
+        for (driver, value) in conversion.convert_vector(self.convert,
+                ('GV6', 'GV7', 'GV8', 'GV9', 'GV10', 'GV11'), values):
+            if value is not None:
+                self.controller.publisher.publish(self, driver, value)
@@ -9,10 +9,18 @@ import time
 import datetime
 import urllib3
 import json
-import socket
 import math
-import threading
 import node_funcs
+from nodes import ingest
+from nodes import capture
+from nodes import metrics
+from nodes import publish
+from nodes import station as wfstation
+from nodes import psychrometrics
+from nodes import daily
+from nodes import periods
+from nodes import persist
+from nodes import history
 from nodes import temperature
 from nodes import humidity
 from nodes import pressure
@@ -24,6 +32,15 @@ from nodes import hub
 
 LOGGER = polyinterface.LOGGER
 
+# node showing each of the daily statistics
+DAILY_NODES = {
+        'temperature': 'temperature',
+        'humidity': 'humidity',
+        'pressure': 'pressure',
+        'gust': 'wind',
+        }
+
+
 @node_funcs.add_functions_as_methods(node_funcs.functions)
 class Controller(polyinterface.Controller):
     def __init__(self, polyglot):
@@ -33,7 +50,6 @@ class Controller(polyinterface.Controller):
         self.address = 'wf'
         self.primary = self.address
         self.stopping = False
-        self.stopped = True
         self.rain_data = {
                 'hourly': 0,
                 'hour' : 0,
@@ -52,9 +68,20 @@ class Controller(polyinterface.Controller):
         self.hb = 0
         self.hub_timestamp = 0
         self.tempest = False
+        self.receiver = None
+        self.packet_filter = ingest.PacketFilter()
+        self.dedup = ingest.Dedup()
+        self.losses = (0, 0, 0)
+        self.metrics = metrics.Metrics()
+        self.publisher = publish.Publisher()
+        self.persist = persist.WriteBehind(self.rain_data,
+                self.poly.saveCustomData)
+        self.history = None
         self.poly.onConfig(self.process_config)
         self.poly.onStop(self.my_stop)
         self.devices = []
+        self.stations = []
+        self.dispatch = {}  # serial number -> list of stations
         self.discovered = ""
         self.units = {
                 'temperature': 'c',
@@ -75,6 +102,7 @@ class Controller(polyinterface.Controller):
             'default': 50222,
             'isRequired': False,
             'notice': '',
+            'type': int,
             },
             {
             'name': 'Sky S/N',
@@ -99,20 +127,117 @@ class Controller(polyinterface.Controller):
             'default': 'us',
             'isRequired': False,
             'notice': '',
+            'choices': ('us', 'uk', 'metric'),
             },
             {
             'name': 'Elevation',
             'default': 0,
             'isRequired': False,
             'notice': '',
+            'type': float,
             },
             {
             'name': 'AGL',
             'default': 0,
             'isRequired': False,
             'notice': '',
+            'type': float,
+            },
+            {
+            'name': 'IngestMode',
+            'default': 'thread',
+            'isRequired': False,
+            'notice': '',
+            'choices': ingest.MODES,
+            },
+            {
+            'name': 'WindInterval',
+            'default': 15,
+            'isRequired': False,
+            'notice': '',
+            'type': int,
+            },
+            {
+            'name': 'CaptureFile',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'QueueSize',
+            'default': 256,
+            'isRequired': False,
+            'notice': '',
+            'type': int,
+            },
+            {
+            'name': 'QueuePolicy',
+            'default': 'coalesce',
+            'isRequired': False,
+            'notice': '',
+            'choices': ingest.POLICIES,
+            },
+            {
+            'name': 'Metrics',
+            'default': 'false',
+            'isRequired': False,
+            'notice': '',
+            'type': node_funcs.boolean,
+            },
+            {
+            'name': 'Deadband',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'MaxSilence',
+            'default': 900,
+            'isRequired': False,
+            'notice': '',
+            'type': float,
+            },
+            {
+            'name': 'SaveInterval',
+            'default': 300,
+            'type': int,
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'HistoryFile',
+            'default': 'history.db',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'HistoryDays',
+            'default': 400,
+            'type': int,
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'HistoryMaxMB',
+            'default': 200,
+            'type': float,
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'RainStartup',
+            'default': 'history',
+            'isRequired': False,
+            'notice': '',
+            'choices': ('history', 'cloud'),
             },
             ])
+        self.params.subscribe(self.set_metrics, 'Metrics')
+        self.params.subscribe(self.set_publisher, 'Deadband', 'MaxSilence')
+        self.params.subscribe(self.set_location, 'Elevation', 'AGL')
+        self.params.subscribe(self.set_save_interval, 'SaveInterval')
+        self.params.subscribe(self.start_history, 'HistoryFile',
+                'HistoryDays', 'HistoryMaxMB')
 
     def process_config(self, config):
         (valid, changed) = self.params.update_from_polyglot(config)
@@ -129,24 +254,43 @@ class Controller(polyinterface.Controller):
         elif valid:
             LOGGER.debug('-- configuration not changed, but is valid')
 
-    def query_wf(self):
+    def set_location(self):
+        """
+            Rebuild the first station's context if the Elevation or AGL
+            parameters were changed.
+        """
+        if self.stations == []:
+            return
+        station = self.stations[0]
+        elevation = self.params.get('Elevation')
+        agl = self.params.get('AGL')
+        if elevation != station.elevation or agl != station.agl:
+            LOGGER.info('Station location changed, elevation {} AGL {}'.format(elevation, agl))
+            station.set_location(elevation, agl)
+
+    def query_wf(self, station):
         """
         We need to call this after we get the customParams because
         we need the station number. However, we may want some of the
         data here to override user entered data.  Specifically, elevation
         and units.
+
+        Device serial numbers, elevation and AGL are saved in the
+        station object.  For the first station they are also saved
+        as the custom parameters.
         """
-        if self.params.get('Station') == "":
+        if station.id == "":
             LOGGER.info('no station defined, skipping lookup.')
             return
 
         air_found = False
         sky_found = False
         tempest_found = False
+        primary = (station.index == 0)
 
-        self.devices = []  # clear the devcies array
+        station.devices = []  # clear the devcies array
         path_str = '/swd/rest/stations/'
-        path_str += self.params.get('Station')
+        path_str += station.id
         path_str += '?api_key=6c8c96f9-e561-43dd-b173-5198d8797e0a'
 
         try:
@@ -155,38 +299,48 @@ class Controller(polyinterface.Controller):
             # Get station meta data. We really want AIR height above ground
             c = http.request('GET', path_str)
             awdata = json.loads(c.data.decode('utf-8'))
-            for station in awdata['stations']:
-                LOGGER.info('found station: ' + str(station['location_id']) + ' ' + station['name'])
-                if str(station['location_id']) == str(self.params.get('Station')):
-                    LOGGER.debug(station)
+            for wfs in awdata['stations']:
+                LOGGER.info('found station: ' + str(wfs['location_id']) + ' ' + wfs['name'])
+                if str(wfs['location_id']) == station.id:
+                    LOGGER.debug(wfs)
                     LOGGER.debug('-----------------------------------')
-                    LOGGER.debug(station['devices'])
-                    self.params.set('Elevation', float(station['station_meta']['elevation']))
-                    for device in station['devices']:
+                    LOGGER.debug(wfs['devices'])
+                    station.elevation = float(wfs['station_meta']['elevation'])
+                    station.timezone = wfs.get('timezone')
+                    for device in wfs['devices']:
                         if 'serial_number' not in device:
                             LOGGER.error('Bad device record for device ID ' + str(device['device_id']))
                             continue
 
                         LOGGER.info('  ' + device['serial_number'] + ' -- ' + device['device_type'])
-                        if device['serial_number'] not in self.devices:
-                            self.devices.append(device['serial_number'])
+                        station.add_device(device['serial_number'])
 
                         if device['device_type'] == 'AR' and not air_found:
-                            self.params.set('Air S/N', device['serial_number'])
-                            self.params.set('AGL', float(device['device_meta']['agl']))
+                            station.air_sn = device['serial_number']
+                            station.agl = float(device['device_meta']['agl'])
                             air_found = True
-                            self.Tempest = False
+                            station.tempest = False
                         elif device['device_type'] == 'ST' and not tempest_found:
-                            self.params.set('Tempest S/N', device['serial_number'])
-                            self.params.set('AGL', float(device['device_meta']['agl']))
+                            station.tempest_sn = device['serial_number']
+                            station.agl = float(device['device_meta']['agl'])
                             tempest_found = True
-                            self.Tempest = True
-                            device_id = device['device_id']
+                            station.tempest = True
+                            station.device_id = device['device_id']
                         elif device['device_type'] == 'SK' and not sky_found:
-                            self.params.set('Sky S/N', device['serial_number'])
+                            station.sky_sn = device['serial_number']
                             sky_found = True
-                            self.Tempest = False
-                            device_id = device['device_id']
+                            station.tempest = False
+                            station.device_id = device['device_id']
+
+                    if primary:
+                        self.params.set('Elevation', station.elevation)
+                        self.params.set('AGL', station.agl)
+                        if air_found:
+                            self.params.set('Air S/N', station.air_sn)
+                        if sky_found:
+                            self.params.set('Sky S/N', station.sky_sn)
+                        if tempest_found:
+                            self.params.set('Tempest S/N', station.tempest_sn)
 
 
                 else:
@@ -196,36 +350,39 @@ class Controller(polyinterface.Controller):
 
             # Get station observations. Pull Elevation and user unit prefs.
             path_str = '/swd/rest/observations/station/'
-            path_str += self.params.get('Station')
+            path_str += station.id
             path_str += '?api_key=6c8c96f9-e561-43dd-b173-5198d8797e0a'
             c = http.request('GET', path_str)
 
             awdata = json.loads(c.data.decode('utf-8'))
 
-            # TODO: check user preference for units and set accordingly
-            # Check distance & temp
-            # if dist in miles & temp in F == US
-            # if dist in miles & temp in C == UK
-            # else == metric
-            self.units['temperature'] = awdata['station_units']['units_temp']
-            self.units['wind'] = awdata['station_units']['units_wind']
-            self.units['rain'] = awdata['station_units']['units_precip']
-            self.units['pressure'] = awdata['station_units']['units_pressure']
-            self.units['distance'] = awdata['station_units']['units_distance']
-            self.units['other'] = awdata['station_units']['units_other']
-
-            temp_unit = awdata['station_units']['units_temp']
-            dist_unit = awdata['station_units']['units_distance']
-
-            if temp_unit == 'f' and dist_unit == 'mi':
-                LOGGER.info('WF says units are US')
-                self.params.set('Units', 'us')
-            elif temp_unit == 'c' and dist_unit == 'mi':
-                LOGGER.info('WF says units are UK')
-                self.params.set('Units', 'uk')
-            else:
-                LOGGER.info('WF says units are metric')
-                self.params.set('Units', 'metric')
+            # Units are one setting for the whole node server, they
+            # follow the primary station's WF preferences.
+            if primary:
+                # TODO: check user preference for units and set accordingly
+                # Check distance & temp
+                # if dist in miles & temp in F == US
+                # if dist in miles & temp in C == UK
+                # else == metric
+                self.units['temperature'] = awdata['station_units']['units_temp']
+                self.units['wind'] = awdata['station_units']['units_wind']
+                self.units['rain'] = awdata['station_units']['units_precip']
+                self.units['pressure'] = awdata['station_units']['units_pressure']
+                self.units['distance'] = awdata['station_units']['units_distance']
+                self.units['other'] = awdata['station_units']['units_other']
+
+                temp_unit = awdata['station_units']['units_temp']
+                dist_unit = awdata['station_units']['units_distance']
+
+                if temp_unit == 'f' and dist_unit == 'mi':
+                    LOGGER.info('WF says units are US')
+                    self.params.set('Units', 'us')
+                elif temp_unit == 'c' and dist_unit == 'mi':
+                    LOGGER.info('WF says units are UK')
+                    self.params.set('Units', 'uk')
+                else:
+                    LOGGER.info('WF says units are metric')
+                    self.params.set('Units', 'metric')
 
             # Override entered elevation with info from station
             # TODO: Only override if current value is 0?
@@ -241,98 +398,14 @@ class Controller(polyinterface.Controller):
             LOGGER.info('yesterday rainfall = %f' % p_rain)
             c.close()
 
-            # Do month by month query of rain info.
-            today = datetime.datetime.today()
-            y_rain = 0
-            for month in range(1,today.month+1):
-                try:
-                    m_rain = 0
-                    # get epoch time for start of month and end of month
-                    datem = datetime.datetime(today.year, month, 1)
-                    start_date = datem.replace(day=1)
-                    #end_date = datem.replace(month=(month+1 % 12), day=1) - datetime.timedelta(days=1)
-                    end_date = datem.replace(month=(month+1 % 12), day=1)
-
-                    # make request:
-                    #  /swd/rest/observations/device/<id>?time_start=start&time_end=end&api_key=
-                    path_str = '/swd/rest/observations/device/'
-                    path_str += str(device_id) + '?'
-                    path_str += 'time_start=' + str(int(start_date.timestamp()))
-                    path_str += '&time_end=' + str(int(end_date.timestamp()))
-                    path_str += '&api_key=6c8c96f9-e561-43dd-b173-5198d8797e0a'
-
-                    LOGGER.info('path = ' + path_str)
-
-                    c = http.request('GET', path_str)
-                    awdata = json.loads(c.data.decode('utf-8'))
-
-                    # we should now have an array of observations
-                    for obs in awdata['obs']:
-                        # for sky, index 3 is daily rain.  for tempest it is index 12
-                        if sky_found:
-                            m_rain += obs[3]
-                            y_rain += obs[3]
-                        elif tempest_found:
-                            m_rain += obs[12]
-                            y_rain += obs[12]
-
-                    LOGGER.info('Month ' + str(month) + ' had rain = ' + str(m_rain))
-
-                    c.close()
-                except:
-                    LOGGER.error('Failed to get rain for month %d' % month);
-                    c.close()
-
-            LOGGER.info('yearly rain total = ' + str(y_rain))
-
-            # Need to do a separate query for weekly rain
-            start_date = today - datetime.timedelta(days=7)
-            end_date = today
-            path_str = '/swd/rest/observations/device/'
-            path_str += str(device_id) + '?'
-            path_str += 'time_start=' + str(int(start_date.timestamp()))
-            path_str += '&time_end=' + str(int(end_date.timestamp()))
-            path_str += '&api_key=6c8c96f9-e561-43dd-b173-5198d8797e0a'
-
-            LOGGER.info('path = ' + path_str)
-
-            try:
-                c = http.request('GET', path_str)
-                awdata = json.loads(c.data.decode('utf-8'))
-                w_rain = 0
-                for obs in awdata['obs']:
-                    if sky_found:
-                        w_rain += obs[3]
-                    elif tempest_found:
-                        w_rain += obs[12]
-
-                c.close()
-            except:
-                LOGGER.error('Failed to get weekly rain')
-                c.close()
-
-            LOGGER.info('weekly rain total = ' + str(w_rain))
+            if self.params.get('RainStartup') != 'history' or \
+                    not self.rain_from_history(station, http, sky_found):
+                self.rain_from_cloud(station, http, sky_found, d_rain, p_rain)
 
             http.close()
 
-            if y_rain > 0:
-                self.rain_data['yearly'] = y_rain
-                self.rain_data['year'] = datetime.datetime.now().year
-            if m_rain > 0:
-                self.rain_data['monthly'] = m_rain
-                self.rain_data['month'] = datetime.datetime.now().month
-            if w_rain > 0:
-                self.rain_data['weekly'] = w_rain
-                self.rain_data['week'] = datetime.datetime.now().isocalendar()[1]
-            if d_rain > 0:
-                self.rain_data['daily'] = d_rain
-                self.rain_data['day'] = datetime.datetime.now().day
-            if p_rain > 0:
-                self.rain_data['yesterday'] = p_rain
-
-            self.rain_data['hourly'] = 0
-
-            self.params.save_params(self)
+            if primary:
+                self.params.save_params(self)
         except Exception as e:
             LOGGER.error('Bad: %s' % str(e))
 
@@ -342,21 +415,24 @@ class Controller(polyinterface.Controller):
         self.set_logging_level()
         self.check_params()
         self.read_custom_data()
+        self.read_journal()
+        if self.history is None:
+            self.start_history()
         if self.params.isSet('Station'):
             LOGGER.info('Discover station info / create nodes')
             self.discover()
 
-        LOGGER.info('Starting thread for UDP data')
-        self.udp = threading.Thread(target = self.udp_data)
-        self.udp.daemon = True
-        self.udp.start()
+        self.set_metrics()
+        self.set_publisher()
+        self.set_save_interval()
+        self.start_udp()
 
         #for node in self.nodes:
         #       LOGGER.info (self.nodes[node].name + ' is at index ' + node)
         LOGGER.info('WeatherFlow Node Server Started.')
 
     def shortPoll(self):
-        pass
+        self.flush_rapid_wind()
 
     def longPoll(self):
         """
@@ -366,6 +442,14 @@ class Controller(polyinterface.Controller):
         """
         self.heartbeat()
         self.set_hub_timestamp()
+        self.log_queue_stats()
+        self.report_metrics()
+        self.log_sensor_history()
+        self.persist.tick()
+        if self.history is not None:
+            self.history.prune()
+        if self.receiver is not None and self.receiver.capture is not None:
+            self.receiver.capture.flush()
 
     def query(self):
         for node in self.nodes:
@@ -374,7 +458,7 @@ class Controller(polyinterface.Controller):
 
     def discover(self, *args, **kwargs):
         """
-        Add basic weather sensor nodes
+        Add basic weather sensor nodes for each station
                 - Temperature (temp, dewpoint, heat index, wind chill, feels)
                 - Humidity
                 - Pressure (abs, sealevel, trend)
@@ -384,70 +468,163 @@ class Controller(polyinterface.Controller):
                 - Lightning (strikes, distance)
         """
 
-        self.query_wf()
+        old_stations = self.stations
+        stations = []
+        for sid in wfstation.parse_ids(self.params.get('Station')):
+            if sid in [st.id for st in stations]:
+                continue
+            station = wfstation.Station(sid, len(stations))
+            station.rain_data = self.station_rain_data(station)
+
+            if station.index == 0:
+                # Manually entered values, used if the WF servers can't
+                # be reached.
+                station.set_location(self.params.get('Elevation'),
+                        self.params.get('AGL'))
+
+            self.query_wf(station)
+            # elevation/AGL may have come from the WF servers
+            station.set_location()
+
+            if station.index == 0 and station.devices == []:
+                station.air_sn = self.params.get('Air S/N')
+                station.sky_sn = self.params.get('Sky S/N')
+                station.tempest_sn = self.params.get('Tempest S/N')
+                station.tempest = (station.tempest_sn != '')
+                for sn in (station.air_sn, station.sky_sn, station.tempest_sn):
+                    station.add_device(sn)
+
+            stations.append(station)
+
+        for old in old_stations:
+            if old.id not in [st.id for st in stations]:
+                LOGGER.info('Station ' + old.id + ' removed, deleting its nodes')
+                for node in old.nodes.values():
+                    self.delNode(node.address)
+                if 'stations' in self.rain_data and old.id in self.rain_data['stations']:
+                    del self.rain_data['stations'][old.id]
+
         self.discovered = self.params.get('Station')
 
-        node = temperature.TemperatureNode(self, self.address, 'temperature', 'Temperatures')
+        # Everything a packet handler uses is set up before the new
+        # stations are handed to the receiver.
+        interval = self.wind_interval()
+        for station in stations:
+            self.add_station_nodes(station)
+            station.wind_engine = wind.WindEngine()
+            if interval > 0:
+                station.rapid_wind = wind.RapidWind(interval)
+        if interval > 0:
+            self.packet_filter.set_types(ingest.HANDLED_TYPES)
+        else:
+            self.packet_filter.set_types([t for t in ingest.HANDLED_TYPES if t != 'rapid_wind'])
+
+        # Build the serial number -> station dispatch table.  A device
+        # (I.E. a shared hub) may belong to more than one station.
+        dispatch = {}
+        devices = []
+        for station in stations:
+            for sn in station.devices:
+                dispatch.setdefault(sn, []).append(station)
+                if sn not in devices:
+                    devices.append(sn)
+
+        self.stations = stations
+        self.dispatch = dispatch
+        self.devices = devices
+        self.tempest = (stations != [] and stations[0].tempest)
+        self.packet_filter.set_serials(self.devices)
+
+    def wind_interval(self):
+        return max(0, self.params.get('WindInterval'))
+
+    def flush_rapid_wind(self):
+        now = time.time()
+        for station in self.stations:
+            if station.rapid_wind is None:
+                continue
+            sample = station.rapid_wind.flush(now)
+            if sample is not None:
+                station.nodes['wind'].update_rapid(sample)
+
+    def add_station_nodes(self, station):
+        node = temperature.TemperatureNode(self, self.address, station.address('temperature'), station.title('Temperatures'))
         node.SetUnits(self.units['temperature'])
         self.addNode(node)
+        station.nodes['temperature'] = node
 
-        node = humidity.HumidityNode(self, self.address, 'humidity', 'Humidity')
+        node = humidity.HumidityNode(self, self.address, station.address('humidity'), station.title('Humidity'))
         node.SetUnits(self.params.get('Units'))
         self.addNode(node)
-        node = pressure.PressureNode(self, self.address, 'pressure', 'Barometric Pressure')
+        station.nodes['humidity'] = node
+        node = pressure.PressureNode(self, self.address, station.address('pressure'), station.title('Barometric Pressure'))
         node.SetUnits(self.units['pressure'])
         self.addNode(node)
-        node = wind.WindNode(self, self.address, 'wind', 'Wind')
+        station.nodes['pressure'] = node
+        node = wind.WindNode(self, self.address, station.address('wind'), station.title('Wind'))
         node.SetUnits(self.units['wind'])
         self.addNode(node)
-        node = rain.PrecipitationNode(self, self.address, 'rain', 'Precipitation')
+        station.nodes['wind'] = node
+        node = rain.PrecipitationNode(self, self.address, station.address('rain'), station.title('Precipitation'))
         node.SetUnits(self.units['rain'])
         self.addNode(node)
-        node = light.LightNode(self, self.address, 'light', 'Illumination')
+        station.nodes['rain'] = node
+        node = light.LightNode(self, self.address, station.address('light'), station.title('Illumination'))
         node.SetUnits(self.params.get('Units'))
         self.addNode(node)
-        node = lightning.LightningNode(self, self.address, 'lightning', 'Lightning')
+        station.nodes['light'] = node
+        node = lightning.LightningNode(self, self.address, station.address('lightning'), station.title('Lightning'))
         node.SetUnits(self.units['distance'])
         self.addNode(node)
+        station.nodes['lightning'] = node
 
-        # TODO: Add hub node with battery and rssi (and sensor status?) info
-        #  There are two different hub node ID's, one for air/sky and one
-        #  for tempest.  Use self.devices to determine which we want to 
-        #  create here.
-        #  self.devices[] holds the devices that we want to track.
+        # There are different hub node ID's depending on the devices
+        # the station has.  station.devices holds the devices that we
+        # want to track.
         # TODO: Wait for hub node to really be deleted.
-        if self.rain_data['station'] != self.params.get('Station'):
+        if station.rain_data['station'] != station.id:
                 LOGGER.info('Station has changed from ' + 
-                        self.rain_data['station'] + ' to ' +
-                        self.params.get('Station'))
-                self.rain_data['station'] = self.params.get('Station')
-                self.poly.saveCustomData(self.rain_data)
+                        station.rain_data['station'] + ' to ' +
+                        station.id)
+                station.rain_data['station'] = station.id
+                self.persist.flush(force=True)
                 LOGGER.debug(self.polyConfig['customData'])
 
                 LOGGER.debug('deleting existing sensor status node')
-                self.delNode('hub')
+                self.delNode(station.address('hub'))
                 time.sleep(3)  # give it some time to actually happen
 
         LOGGER.debug('Attempt to add sensor status node')
 
-        if self.tempest:
-            node = hub.HubNode(self, self.address, 'hub', 'Hub', self.devices);
-        else:
-            node = hub.HubNode(self, self.address, 'hub', 'Hub', self.devices);
+        node = hub.HubNode(self, self.address, station.address('hub'), station.title('Hub'), station.devices);
         LOGGER.debug('Sensor status node has been created, so add it')
+        station.nodes['hub'] = node
         try:
             self.addNode(node)
         except Exception as e:
             LOGGER.error('Error adding sensor status node: ' + str(e))
-        
-                # TODO: Can we query the current accumulation data from
-                # weatherflow servers???
 
-        self.nodes['rain'].InitializeRain(self.rain_data)
+        station.nodes['rain'].InitializeRain(station.rain_data,
+                periods.zone(station.timezone))
+
+        station.daily = daily.DailyStats(periods.zone(station.timezone))
+        station.daily.restore(station.rain_data.get('daily_stats'))
+
+    def station_rain_data(self, station):
+        """
+            The first station's rain accumulations are kept at the top
+            level of the custom data (where they've always been), the
+            other stations are kept in a 'stations' dictionary indexed
+            by station ID.
+        """
+        if station.index == 0:
+            return self.rain_data
 
-            # Might be able to get some information from API using station
-            # number:
-            # swd.weatherflow.com/swd/rest/observations/station/<num>?apikey=
+        if 'stations' not in self.rain_data:
+            self.rain_data['stations'] = {}
+        if station.id not in self.rain_data['stations']:
+            self.rain_data['stations'][station.id] = wfstation.new_rain_data(station.id)
+        return self.rain_data['stations'][station.id]
 
     def read_custom_data(self):
         if 'customData' in self.polyConfig:
@@ -459,6 +636,7 @@ class Controller(polyinterface.Controller):
                 self.rain_data['yearly'] = self.polyConfig['customData']['yearly']
                 self.rain_data['hour'] = self.polyConfig['customData']['hour']
                 self.rain_data['day'] = self.polyConfig['customData']['day']
+                self.rain_data['week'] = self.polyConfig['customData'].get('week', 0)
                 self.rain_data['month'] = self.polyConfig['customData']['month']
                 self.rain_data['year'] = self.polyConfig['customData']['year']
                 self.rain_data['yesterday'] = self.polyConfig['customData']['yesterday']
@@ -477,6 +655,236 @@ class Controller(polyinterface.Controller):
                 self.rain_data['month'] = datetime.datetime.now().month
                 self.rain_data['year'] = datetime.datetime.now().year
 
+            if 'stations' in self.polyConfig['customData']:
+                self.rain_data['stations'] = self.polyConfig['customData']['stations']
+            if 'daily_stats' in self.polyConfig['customData']:
+                self.rain_data['daily_stats'] = self.polyConfig['customData']['daily_stats']
+            if 'saved' in self.polyConfig['customData']:
+                self.rain_data['saved'] = self.polyConfig['customData']['saved']
+
+    def read_journal(self):
+        """
+            Use the local journal if it's newer than what Polyglot had,
+            I.E. we didn't get to save before the last exit.
+        """
+        journal = persist.read_journal(self.persist.journal)
+        if journal is None:
+            return
+        (when, data) = journal
+        if when > self.rain_data.get('saved', 0):
+            LOGGER.info('Restoring rain data from the journal')
+            self.rain_data.update(data)
+
+    def rain_from_cloud(self, station, http, sky, d_rain, p_rain):
+        """
+            Get the rain totals by adding up a year of observations
+            from the WF servers, a month at a time.
+        """
+        # Do month by month query of rain info.
+        today = datetime.datetime.today()
+        y_rain = 0
+        for month in range(1,today.month+1):
+            try:
+                m_rain = 0
+                # get epoch time for start of month and end of month
+                datem = datetime.datetime(today.year, month, 1)
+                start_date = datem.replace(day=1)
+                #end_date = datem.replace(month=(month+1 % 12), day=1) - datetime.timedelta(days=1)
+                end_date = datem.replace(month=(month+1 % 12), day=1)
+
+                # make request:
+                #  /swd/rest/observations/device/<id>?time_start=start&time_end=end&api_key=
+                path_str = '/swd/rest/observations/device/'
+                path_str += str(station.device_id) + '?'
+                path_str += 'time_start=' + str(int(start_date.timestamp()))
+                path_str += '&time_end=' + str(int(end_date.timestamp()))
+                path_str += '&api_key=6c8c96f9-e561-43dd-b173-5198d8797e0a'
+
+                LOGGER.info('path = ' + path_str)
+
+                c = http.request('GET', path_str)
+                awdata = json.loads(c.data.decode('utf-8'))
+
+                # we should now have an array of observations
+                for obs in awdata['obs']:
+                    # for sky, index 3 is daily rain.  for tempest it is index 12
+                    if sky:
+                        m_rain += obs[3]
+                        y_rain += obs[3]
+                    else:
+                        m_rain += obs[12]
+                        y_rain += obs[12]
+
+                LOGGER.info('Month ' + str(month) + ' had rain = ' + str(m_rain))
+
+                c.close()
+            except:
+                LOGGER.error('Failed to get rain for month %d' % month);
+                c.close()
+
+        LOGGER.info('yearly rain total = ' + str(y_rain))
+
+        # Need to do a separate query for weekly rain
+        start_date = today - datetime.timedelta(days=7)
+        end_date = today
+        path_str = '/swd/rest/observations/device/'
+        path_str += str(station.device_id) + '?'
+        path_str += 'time_start=' + str(int(start_date.timestamp()))
+        path_str += '&time_end=' + str(int(end_date.timestamp()))
+        path_str += '&api_key=6c8c96f9-e561-43dd-b173-5198d8797e0a'
+
+        LOGGER.info('path = ' + path_str)
+
+        try:
+            c = http.request('GET', path_str)
+            awdata = json.loads(c.data.decode('utf-8'))
+            w_rain = 0
+            for obs in awdata['obs']:
+                if sky:
+                    w_rain += obs[3]
+                else:
+                    w_rain += obs[12]
+
+            c.close()
+        except:
+            LOGGER.error('Failed to get weekly rain')
+            c.close()
+
+        LOGGER.info('weekly rain total = ' + str(w_rain))
+
+        rain_data = station.rain_data
+        if y_rain > 0:
+            rain_data['yearly'] = y_rain
+            rain_data['year'] = datetime.datetime.now().year
+        if m_rain > 0:
+            rain_data['monthly'] = m_rain
+            rain_data['month'] = datetime.datetime.now().month
+        if w_rain > 0:
+            rain_data['weekly'] = w_rain
+            rain_data['week'] = datetime.datetime.now().isocalendar()[1]
+        if d_rain > 0:
+            rain_data['daily'] = d_rain
+            rain_data['day'] = datetime.datetime.now().day
+        if p_rain > 0:
+            rain_data['yesterday'] = p_rain
+
+        rain_data['hourly'] = 0
+
+    def fetch_device_obs(self, http, device_id, start, end):
+        """
+            Observations for a device from the WF servers, or None if
+            the request failed.
+        """
+        path_str = '/swd/rest/observations/device/'
+        path_str += str(device_id) + '?'
+        path_str += 'time_start=' + str(int(start))
+        path_str += '&time_end=' + str(int(end))
+        path_str += '&api_key=6c8c96f9-e561-43dd-b173-5198d8797e0a'
+
+        LOGGER.info('path = ' + path_str)
+
+        try:
+            c = http.request('GET', path_str)
+            awdata = json.loads(c.data.decode('utf-8'))
+            c.close()
+            return awdata['obs'] or []
+        except Exception as e:
+            LOGGER.error('Failed to get observations: ' + str(e))
+            return None
+
+    def rain_from_history(self, station, http, sky):
+        """
+            Work out the rain totals from the local observation history.
+            Only the gaps between stored observations (and since the
+            last one) are fetched from the WF servers, and what they
+            return is added to the history.  The time that's been
+            checked is recorded so the next start only looks at what's
+            newer.  A total that still has a hole in it is left as it
+            was saved.  Returns False if there's no history to use.
+        """
+        store = self.history
+        serial = station.sky_sn if sky else station.tempest_sn
+        if store is None or serial == '':
+            return False
+        ptype = 'obs_sky' if sky else 'obs_st'
+
+        now = time.time()
+        tz = periods.zone(station.timezone)
+        (starts, ends, keys) = periods.boundaries(now, tz)
+        yesterday = periods.midnight(periods.local_date(now, tz) -
+                datetime.timedelta(days=1), tz)
+
+        # Gaps within a day of each other are fetched together, the
+        # servers return one minute data for up to a day.  Longer gaps
+        # go 30 days at a time, the most that still comes back in 30
+        # minute buckets.
+        first = min(starts + (yesterday,))
+        windows = []
+        for (start, end) in store.gaps([serial], first, now):
+            if windows and end - windows[-1][0] <= 86400:
+                windows[-1][1].append((start, end))
+                continue
+            while end - start > 86400:
+                chunk = min(end, start + 30 * 86400)
+                windows.append((start, [(start, chunk)]))
+                start = chunk
+            if start < end:
+                windows.append((start, [(start, end)]))
+
+        missing = []
+        for (start, gaps) in windows:
+            end = gaps[-1][1]
+            obs = self.fetch_device_obs(http, station.device_id, start, end)
+            if obs is None:
+                missing.extend(gaps)
+                continue
+            # only rows that fall in a gap, the rest are stored already
+            store.add(serial, ptype, [o for o in obs if o and
+                    any(s <= o[0] < e for (s, e) in gaps)])
+        # Up to the first failed fetch is done with.  The last hour may
+        # not have reached the servers yet.
+        store.checked(serial, first, min([now - 3600] + [s for (s, e) in missing]))
+        store.flush()
+
+        rain_data = station.rain_data
+        totals = (('hourly', 'hour', starts[0], now),
+                ('daily', 'day', starts[1], now),
+                ('weekly', 'week', starts[2], now),
+                ('monthly', 'month', starts[3], now),
+                ('yearly', 'year', starts[4], now),
+                ('yesterday', None, yesterday, starts[1]))
+        for (total, key, start, end) in totals:
+            if any(s < end and e > start for (s, e) in missing):
+                LOGGER.warning('No observations for part of the ' + total +
+                        ' rain total, keeping the saved value')
+                continue
+            rain_data[total] = store.rain_total([serial], start, end)
+            if key is not None:
+                rain_data[key] = keys[key]
+            LOGGER.info(total + ' rain total = ' + str(rain_data[total]))
+        return True
+
+    def start_history(self):
+        """
+            (Re)open the observation history with the current
+            parameters.  An empty HistoryFile turns it off.
+        """
+        old = self.history
+        path = self.params.get('HistoryFile')
+        store = None
+        if path != '':
+            try:
+                store = history.History(path, self.params.get('HistoryDays'),
+                        self.params.get('HistoryMaxMB'))
+            except Exception as e:
+                LOGGER.error('Failed to open history ' + path + ': ' + str(e))
+        self.history = store
+        if old is not None:
+            old.close()
+
+    def set_save_interval(self):
+        self.persist.min_interval = self.params.get('SaveInterval')
+
     def heartbeat(self):
         LOGGER.debug('heartbeat hb={}'.format(self.hb))
         if self.hb == 0:
@@ -497,9 +905,25 @@ class Controller(polyinterface.Controller):
 
     def my_stop(self):
         self.stopping = True
-        # Is there something we should do here to really stop?
-        while not self.stopped:
-            self.stopping = True
+        if self.receiver is not None:
+            # stop listening, let the worker finish what's queued and
+            # wait at most 5 seconds for both threads.
+            if not self.receiver.shutdown(5.0):
+                LOGGER.warning('UDP threads did not exit in time.')
+
+            if self.receiver.capture is not None:
+                self.receiver.capture.close()
+
+        if self.history is not None:
+            self.history.close()
+
+        # make sure the latest rain totals are saved
+        for station in self.stations:
+            if station.daily is not None:
+                daily_stats = station.daily.save()
+                with self.persist.lock:
+                    station.rain_data['daily_stats'] = daily_stats
+        self.persist.flush(force=True)
 
         LOGGER.info('WeatherFlow node server UDP thread finished.')
 
@@ -565,40 +989,65 @@ class Controller(polyinterface.Controller):
         st = self.poly.installprofile()
         return st
 
-    def update_rain(self, ra, it):
+    def update_rain(self, station, ra, it, tm):
+        rain_data = station.rain_data
         try:
-            rain = self.nodes['rain']
+            rain = station.nodes['rain']
             rr = (ra * 60) / it
             rain.setDriver('ST', rr)
         except Exception as e:
             LOGGER.error(str(e))
 
-        self.rain_data['hourly'] = rain.hourly_accumulation(ra)
-        self.rain_data['daily'] = rain.daily_accumulation(ra)
-        self.rain_data['yesterday'] = rain.yesterday_accumulation()
-        self.rain_data['weekly'] = rain.weekly_accumulation(ra)
-        self.rain_data['monthly'] = rain.monthly_accumulation(ra)
-        self.rain_data['yearly'] = rain.yearly_accumulation(ra)
+        # one clock for all the totals, the observation's own time
+        changed = rain.accumulate(ra, tm)
+        # the saver may be serializing rain_data on another thread
+        with self.persist.lock:
+            rain_data['hourly'] = rain.hourly_rain
+            rain_data['daily'] = rain.daily_rain
+            rain_data['yesterday'] = rain.yesterday_rain
+            rain_data['weekly'] = rain.weekly_rain
+            rain_data['monthly'] = rain.monthly_rain
+            rain_data['yearly'] = rain.yearly_rain
+            rain_data.update(rain.calendar.keys)
         LOGGER.debug('RAIN %f %f %f %f %f %f %f' %
-            (ra, rr, self.rain_data['hourly'],
-                    self.rain_data['daily'], self.rain_data['weekly'],
-            self.rain_data['monthly'], self.rain_data['yearly']))
-
-        self.rain_data['hour'] = datetime.datetime.now().hour
-        self.rain_data['day'] = datetime.datetime.now().day
-        self.rain_data['month'] = datetime.datetime.now().month
-        self.rain_data['year'] = datetime.datetime.now().year
-
-        rain.setDriver('GV0', self.rain_data['hourly'])
-        rain.setDriver('GV1', self.rain_data['daily'])
-        rain.setDriver('GV2', self.rain_data['weekly'])
-        rain.setDriver('GV3', self.rain_data['monthly'])
-        rain.setDriver('GV4', self.rain_data['yearly'])
-        rain.setDriver('GV5', self.rain_data['yesterday'])
-
-        self.poly.saveCustomData(self.rain_data)
-
-    def air_data(self, data, air_tm):
+            (ra, rr, rain_data['hourly'],
+                    rain_data['daily'], rain_data['weekly'],
+            rain_data['monthly'], rain_data['yearly']))
+
+        rain.setDriver('GV0', rain_data['hourly'])
+        rain.setDriver('GV1', rain_data['daily'])
+        rain.setDriver('GV2', rain_data['weekly'])
+        rain.setDriver('GV3', rain_data['monthly'])
+        rain.setDriver('GV4', rain_data['yearly'])
+        rain.setDriver('GV5', rain_data['yesterday'])
+        rain.raining(1 if ra > 0 else 0)
+
+        # Only save when a total, a period or a daily high/low changed.
+        # The daily means are still brought up to date for the next save.
+        t = self.metrics.start()
+        daily_stats = station.daily.save()
+        extremes = station.daily.extremes()
+        with self.persist.lock:
+            rain_data['daily_stats'] = daily_stats
+        if changed or extremes != station.daily_extremes:
+            station.daily_extremes = extremes
+            self.persist.mark(journal=changed)
+        self.metrics.stop(metrics.PERSIST, t)
+
+    def update_daily(self, station, tm, samples):
+        """
+            Add an observation's samples to the station's daily
+            statistics and publish the results.  samples is a dictionary
+            of daily.QUANTITIES -> value.
+        """
+        stats = station.daily
+        for quantity in samples:
+            stats.add(quantity, samples[quantity], tm)
+        for quantity in samples:
+            node = station.nodes[DAILY_NODES[quantity]]
+            node.update_daily(stats.values(quantity))
+
+    def air_data(self, station, data):
         # process air data
         try:
             tm = data['obs'][0][0] # ts
@@ -608,44 +1057,39 @@ class Controller(polyinterface.Controller):
             ls = data['obs'][0][4] # strikes
             ld = data['obs'][0][5] # distance
 
-            if air_tm == tm:
-                LOGGER.debug('Duplicate AIR observations, ignorning')
-                return air_tm
-
             LOGGER.debug(data)
 
-            air_tm = tm
-            el = float(self.params.get('Elevation')) + float(self.params.get('AGL'))
-            sl = self.nodes['pressure'].toSeaLevel(p, el)
-            trend = self.nodes['pressure'].updateTrend(p)
-            self.nodes['pressure'].update(p, sl, trend)
+            m = self.metrics.start()
+            sl = station.context.sea_level(p)
+            trend = station.nodes['pressure'].updateTrend(p, tm)
             try:
-                fl = self.nodes['temperature'].ApparentTemp(t, self.windspeed/3.6, h)
-                dp = self.nodes['temperature'].Dewpoint(t, h)
-                hi = self.nodes['temperature'].Heatindex(t, h)
-                wc = self.nodes['temperature'].Windchill(t, self.windspeed)
+                (fl, dp, hi, wc, wb, ad) = psychrometrics.derive(t, h, station.windspeed, p)
             except Exception as e:
                 LOGGER.error('Failure to calculate Air temps: ' + str(e))
+            self.metrics.stop(metrics.COMPUTE, m)
 
-            self.nodes['temperature'].update(t, fl, dp, hi, wc)
-            self.nodes['humidity'].update(h)
+            m = self.metrics.start()
+            station.nodes['pressure'].update(p, sl, trend)
+            station.nodes['temperature'].update(t, fl, dp, hi, wc, wb, ad)
+            station.nodes['humidity'].update(h)
+            self.update_daily(station, tm, {'temperature': t,
+                'humidity': h, 'pressure': sl})
 
-            self.nodes['lightning'].update(ls, ld)
+            station.nodes['lightning'].update(ls, ld, tm)
+            self.metrics.stop(metrics.PUBLISH, m)
 
             # battery voltage
             try:
-                self.nodes['hub'].update(data['obs'][0][6], None)
+                station.nodes['hub'].update(data['obs'][0][6], None)
                 #self.setDriver('GV0', data['obs'][0][6], report=True, force=True)
             except Exception as e:
                 LOGGER.error('Failed to update sky battery voltage: ' + str(e))
         except Exception as e:
-            (t, v, tb) = sys.exec_info()
+            (t, v, tb) = sys.exc_info()
             LOGGER.error('Failure in processing AIR data: ' + str(e))
             LOGGER.error('  At: ' + str(tb.tb_lineno));
 
-        return air_tm
-
-    def sky_data(self, data, sky_tm):
+    def sky_data(self, station, data):
         # process sky data
         try:
             LOGGER.debug(data)
@@ -670,36 +1114,39 @@ class Controller(polyinterface.Controller):
             it = data['obs'][0][9]  # reporting interval
             sr = data['obs'][0][10]  # solar radiation
 
-            if sky_tm == tm:
-                LOGGER.debug('Duplicate SKY observations, ignorning')
-                return sky_tm
-
-            sky_tm = tm
-            self.windspeed = ws
+            station.windspeed = ws
             #ra = .58 # just over half a mm of rain each minute
         
-            self.nodes['wind'].update(ws, wd, wg, wl)
-            self.nodes['light'].update(uv, sr, il)
+            m = self.metrics.start()
+            station.wind_engine.add(tm, ws, wd, rapid=False)
+            gd = station.wind_engine.gust_direction()
+            averages = station.wind_engine.averages()
+            self.metrics.stop(metrics.COMPUTE, m)
+
+            m = self.metrics.start()
+            station.nodes['wind'].update(ws, wd, wg, wl, gd)
+            station.nodes['wind'].update_averages(averages)
+            station.nodes['light'].update(uv, sr, il)
+            self.update_daily(station, tm, {'gust': wg})
+            self.metrics.stop(metrics.PUBLISH, m)
 
             try:
-                self.update_rain(ra, it)
+                self.update_rain(station, ra, it, tm)
             except Exception as e:
                 LOGGER.error('Failed to update rain data: ' + str(e))
 
             try:
-                self.nodes['hub'].update(None, data['obs'][0][8])
+                station.nodes['hub'].update(None, data['obs'][0][8])
                 #self.setDriver('GV1', data['obs'][0][8], report=True, force=True)
             except Exception as e:
                 LOGGER.error('Failed to update sky battery voltage: ' + str(e))
 
         except Exception as e:
-            (t, v, tb) = sys.exec_info()
+            (t, v, tb) = sys.exc_info()
             LOGGER.error('Failure in SKY data: ' + str(e))
             LOGGER.error('  At: ' + str(tb.tb_lineno));
 
-        return sky_tm
-
-    def tempest_data(self, data, st_tm):
+    def tempest_data(self, station, data):
         try:
             LOGGER.debug(data)
 
@@ -729,98 +1176,233 @@ class Controller(polyinterface.Controller):
             ld = data['obs'][0][15] # distance
             it = data['obs'][0][17] # reporting interval
 
-            if st_tm == tm:
-                LOGGER.debug('Duplicate Tempest observations, ignorning')
-                return st_tm
-
-            st_tm = tm
-
-            el = float(self.params.get('Elevation')) + float(self.params.get('AGL'))
-            sl = self.nodes['pressure'].toSeaLevel(p, el)
-            trend = self.nodes['pressure'].updateTrend(p)
-            fl = self.nodes['temperature'].ApparentTemp(t, ws, h)
-            dp = self.nodes['temperature'].Dewpoint(t, h)
-            hi = self.nodes['temperature'].Heatindex(t, h)
-            wc = self.nodes['temperature'].Windchill(t, ws)
-
-            self.nodes['pressure'].update(p, sl, trend)
-            self.nodes['temperature'].update(t, fl, dp, hi, wc)
-            self.nodes['humidity'].update(h)
-            self.nodes['lightning'].update(ls, ld)
-            self.nodes['wind'].update(ws, wd, wg, wl)
-            self.nodes['light'].update(uv, sr, il)
-
-            self.update_rain(ra, it)
+            m = self.metrics.start()
+            sl = station.context.sea_level(p)
+            trend = station.nodes['pressure'].updateTrend(p, tm)
+            (fl, dp, hi, wc, wb, ad) = psychrometrics.derive(t, h, ws, p)
+            station.wind_engine.add(tm, ws, wd, rapid=False)
+            gd = station.wind_engine.gust_direction()
+            averages = station.wind_engine.averages()
+            self.metrics.stop(metrics.COMPUTE, m)
+
+            m = self.metrics.start()
+            station.nodes['pressure'].update(p, sl, trend)
+            station.nodes['temperature'].update(t, fl, dp, hi, wc, wb, ad)
+            station.nodes['humidity'].update(h)
+            station.nodes['lightning'].update(ls, ld, tm)
+            station.nodes['wind'].update(ws, wd, wg, wl, gd)
+            station.nodes['wind'].update_averages(averages)
+            station.nodes['light'].update(uv, sr, il)
+            self.update_daily(station, tm, {'temperature': t,
+                'humidity': h, 'pressure': sl, 'gust': wg})
+            self.metrics.stop(metrics.PUBLISH, m)
+
+            self.update_rain(station, ra, it, tm)
 
             # battery voltage
-            self.nodes['hub'].update(data['obs'][0][16], None)
+            station.nodes['hub'].update(data['obs'][0][16], None)
             #self.setDriver('GV0', data['obs'][0][16], report=True, force=True)
 
         except Exception as e:
-            (t, v, tb) = sys.exec_info()
+            (t, v, tb) = sys.exc_info()
             LOGGER.error('Failure in TEMPEST data: ' + str(e))
             LOGGER.error('  At: ' + str(tb.tb_lineno));
 
-        return st_tm
-
-    def udp_data(self):
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-        s.bind(('0.0.0.0', self.params.get('ListenPort')))
-        self.windspeed = 0
-        sky_tm = 0
-        air_tm = 0
-        st_tm  = 0
-
-        LOGGER.info("Starting UDP receive loop")
-        while self.stopping == False:
-            self.stopped = False
+    def strike_event(self, station, data):
+        # evt is [epoch, distance km, energy]
+        try:
+            LOGGER.debug(data)
+            evt = data['evt']
+            station.nodes['lightning'].strike(evt[0], evt[1],
+                    evt[2] if len(evt) > 2 else None)
+        except Exception as e:
+            LOGGER.error('Failure in strike event: ' + str(e))
+
+    def rapid_wind_data(self, station, data):
+        # ob is [epoch, speed m/s, direction]
+        try:
+            tm = data['ob'][0]
+            if data['ob'][1] is not None:
+                ws = data['ob'][1] * (18 / 5) # convert to kph
+            else:
+                ws = 0
+            wd = data['ob'][2]
+
+            station.wind_engine.add(tm, ws, wd)
+            if station.rapid_wind is None:
+                return
+
+            sample = station.rapid_wind.add(tm, ws, wd)
+            if sample is not None:
+                station.nodes['wind'].update_rapid(sample)
+                station.nodes['wind'].update_averages(station.wind_engine.averages())
+        except Exception as e:
+            LOGGER.error('Failure in rapid wind data: ' + str(e))
+
+    def start_udp(self):
+        mode = self.params.get('IngestMode')
+        policy = self.params.get('QueuePolicy')
+        size = self.params.get('QueueSize')
+
+        LOGGER.info('Starting ' + mode + ' UDP receiver on port ' +
+                str(self.params.get('ListenPort')))
+        self.receiver = ingest.create(mode, self.params.get('ListenPort'),
+                self.udp_data, ingest.PacketQueue(size, policy),
+                self.packet_filter)
+        self.receiver.metrics = self.metrics
+
+        if self.params.get('CaptureFile') != '':
             try:
-                hub = s.recvfrom(1024)
-                data = json.loads(hub[0].decode("utf-8")) # hub is a truple (json, ip, port)
-            except:
-                LOGGER.error('JSON processing of data failed')
-                continue
+                self.receiver.capture = capture.Capture(self.params.get('CaptureFile'))
+            except Exception as e:
+                LOGGER.error('Failed to open capture file: ' + str(e))
+
+        self.receiver.start()
 
-            # skip data that's not for the configured station
-            if data['serial_number'] not in self.devices:
-                #LOGGER.info('skipping data, serial number ' + data['serial_number'] + ' not listed')
+    def log_queue_stats(self):
+        if self.receiver is None:
+            return
+        q = self.receiver.queue.stats()
+        d = self.dedup.stats()
+        # one line at INFO when something was lost or repeated since
+        # the last poll, the rest is only for debugging.
+        losses = (q['dropped'], d['duplicates'], d['late'])
+        if losses != self.losses:
+            LOGGER.info('UDP packets dropped={} duplicates={} late={}'.format(*losses))
+            self.losses = losses
+        LOGGER.debug('UDP queue: depth={} max={} received={} dropped={} coalesced={} filtered={}'.format(
+            q['depth'], q['max_depth'], q['received'], q['dropped'],
+            q['coalesced'], self.packet_filter.rejected))
+        LOGGER.debug('Dedup: duplicates={} late={} reordered={}'.format(
+            d['duplicates'], d['late'], d['reordered']))
+        d = self.publisher.stats()
+        LOGGER.debug('Driver updates: sent={} suppressed={} per packet staged={:.1f} sent={:.1f}'.format(
+            d['sent'], d['suppressed'], d['staged_per_batch'],
+            d['sent_per_batch']))
+        d = self.persist.stats()
+        LOGGER.debug('Custom data: updates={} saves={} bytes={} journal writes={} bytes={}'.format(
+            d['marks'], d['flushes'], d['bytes'], d['journal_writes'],
+            d['journal_bytes']))
+        if self.history is not None:
+            d = self.history.stats()
+            LOGGER.debug('History: inserted={} pruned={} bytes={}'.format(
+                d['inserted'], d['pruned'], d['bytes']))
+
+    def set_metrics(self):
+        enabled = self.params.get('Metrics')
+        if enabled != self.metrics.enabled:
+            LOGGER.info('Packet timing metrics ' + ('enabled' if enabled else 'disabled'))
+            self.metrics.reset()
+            self.metrics.enabled = enabled
+
+    def log_sensor_history(self):
+        # each change is logged by the hub node when it happens, the
+        # full history is only for debugging.
+        for station in self.stations:
+            if 'hub' not in station.nodes:
                 continue
+            history = station.nodes['hub'].sensor_history()
+            for device in history:
+                for (name, failures, when) in history[device]:
+                    LOGGER.debug('{} {}: {} failures, last change {}'.format(
+                        device, name, failures,
+                        datetime.datetime.fromtimestamp(when).strftime('%Y-%m-%d %H:%M:%S')))
+
+    def set_publisher(self):
+        self.publisher.configure(self.params.get('Deadband'),
+                self.params.get('MaxSilence'))
+
+    def report_metrics(self):
+        if not self.metrics.enabled:
+            return
+        (packets, mean) = self.metrics.summary()
+        self.setDriver('GV5', packets, report=True, force=True)
+        self.setDriver('GV6', round(mean, 3), report=True, force=True)
+
+    def dump_metrics(self, command=None):
+        if not self.metrics.enabled:
+            LOGGER.info('Packet timing metrics are disabled, set Metrics to true')
+            return
+        for line in self.metrics.dump():
+            LOGGER.info(line)
+        self.report_metrics()
+
+    def udp_data(self, data, received=None):
+        # skip data that's not for one of the configured stations.
+        # The packet is decoded once and handed to every station that
+        # has the device.
+        stations = self.dispatch.get(data['serial_number'])
+        if stations is None:
+            #LOGGER.info('skipping data, serial number ' + data['serial_number'] + ' not listed')
+            return
+
+        # a repeater or second hub may send the same packet again and
+        # packets can arrive out of order.
+        if not self.dedup.check(data['serial_number'], data['type'],
+                ingest.packet_time(data), ingest.packet_identity(data)):
+            LOGGER.debug('Duplicate or late ' + data['type'] + ' from ' + data['serial_number'] + ', ignoring')
+            return
+
+        store = self.history
+        if store is not None and data['type'] in history.TYPES:
+            t = self.metrics.start()
+            store.add(data['serial_number'], data['type'], data['obs'])
+            self.metrics.stop(metrics.PERSIST, t)
+
+        # driver updates for the packet are staged and sent together
+        # at the end.
+        self.publisher.begin()
+        try:
+            for station in stations:
+                self.station_data(station, data)
+        finally:
+            t = self.metrics.start()
+            self.publisher.flush()
+            self.metrics.stop(metrics.PUBLISH, t)
+
+    def station_data(self, station, data):
+        if (data["type"] == "rapid_wind"):
+            self.rapid_wind_data(station, data)
+            return
+
+        if (data["type"] == "evt_strike"):
+            self.strike_event(station, data)
+            return
+
+        if (data["type"] == "evt_precip"):
+            LOGGER.info('Rain started at station ' + station.id)
+            station.nodes['rain'].rain_start()
+            return
 
-            if (data["type"] == "obs_air"):
-                air_tm = self.air_data(data, air_tm)
-
-            if (data["type"] == "obs_st"):
-                st_tm = self.tempest_data(data, st_tm)
-
-            if (data["type"] == "obs_sky"):
-                sky_tm = self.sky_data(data, sky_tm)
-
-            if (data["type"] == "device_status"):
-                if "AR" in data["serial_number"]:
-                    #self.setDriver('GV2', data['rssi'], report=True, force=True)
-                    self.nodes['hub'].update_rssi(data['rssi'], None)
-                    self.nodes['hub'].update_sensors(data['sensor_status'])
-                if "SK" in data["serial_number"]:
-                    #self.setDriver('GV3', data['rssi'], report=True, force=True)
-                    self.nodes['hub'].update_rssi(None, data['rssi'])
-                    self.nodes['hub'].update_sensors(data['sensor_status'])
-                if "ST" in data["serial_number"]:
-                    #self.setDriver('GV2', data['rssi'], report=True, force=True)
-                    self.nodes['hub'].update_rssi(data['rssi'])
-                    self.nodes['hub'].update_sensors(data['sensor_status'])
-
-            if (data["type"] == "hub_status"):
-                # This comes every 10 seconds, but we only update the driver
-                # during longPoll, so just save it.
-                #LOGGER.debug("hub_status: time={} {}".format(time.time(),data))
-                if "timestamp" in data:
-                    self.hub_timestamp = data['timestamp']
-
-        s.close()
-        self.stopped = True
-        self.stop()
+        if (data["type"] == "obs_air"):
+            self.air_data(station, data)
+
+        if (data["type"] == "obs_st"):
+            self.tempest_data(station, data)
+
+        if (data["type"] == "obs_sky"):
+            self.sky_data(station, data)
+
+        if (data["type"] == "device_status"):
+            if "AR" in data["serial_number"]:
+                #self.setDriver('GV2', data['rssi'], report=True, force=True)
+                station.nodes['hub'].update_rssi(data['rssi'], None)
+                station.nodes['hub'].update_sensors(data['sensor_status'], data['serial_number'])
+            if "SK" in data["serial_number"]:
+                #self.setDriver('GV3', data['rssi'], report=True, force=True)
+                station.nodes['hub'].update_rssi(None, data['rssi'])
+                station.nodes['hub'].update_sensors(data['sensor_status'], data['serial_number'])
+            if "ST" in data["serial_number"]:
+                #self.setDriver('GV2', data['rssi'], report=True, force=True)
+                station.nodes['hub'].update_rssi(data['rssi'])
+                station.nodes['hub'].update_sensors(data['sensor_status'], data['serial_number'])
+
+        if (data["type"] == "hub_status"):
+            # This comes every 10 seconds, but we only update the driver
+            # during longPoll, so just save it.
+            #LOGGER.debug("hub_status: time={} {}".format(time.time(),data))
+            if "timestamp" in data:
+                self.hub_timestamp = data['timestamp']
 
     def set_logging_level(self, level=None):
         if level is None:
@@ -851,6 +1433,7 @@ class Controller(polyinterface.Controller):
         'UPDATE_PROFILE': update_profile,
         'REMOVE_NOTICES_ALL': remove_notices_all,
         'DEBUG': set_logging_level,
+        'DUMP_METRICS': dump_metrics,
     }
     # Hub status information here: battery and rssi values.
     drivers = [
@@ -859,7 +1442,9 @@ class Controller(polyinterface.Controller):
             {'driver': 'GV1', 'value': 0, 'uom': 72},  # Sky battery level
             {'driver': 'GV2', 'value': 0, 'uom': 25},  # Air RSSI
             {'driver': 'GV3', 'value': 0, 'uom': 25},  # Sky RSSI
-            {'driver': 'GV4', 'value': 0, 'uom': 57}   # Hub seconds since seen
+            {'driver': 'GV4', 'value': 0, 'uom': 57},  # Hub seconds since seen
+            {'driver': 'GV5', 'value': 0, 'uom': 56},  # Packets timed
+            {'driver': 'GV6', 'value': 0, 'uom': 42},  # Mean ms per packet
             ]
 
 
@@ -12,9 +12,205 @@ import json
 import socket
 import math
 import threading
+import collections
+from nodes import conversion
 
 LOGGER = polyinterface.LOGGER
 
+class RapidWind(object):
+    """
+        Coalesce the 3 second rapid_wind samples.  The latest speed and
+        direction plus the peak speed (and its direction) are held in
+        memory and handed out once per interval.  Every sample counts
+        toward the peak so a gust inside the interval is never lost.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.speed = 0
+        self.direction = 0
+        self.peak = None
+        self.peak_direction = 0
+        self.window_end = 0
+
+    # ts is the packet epoch, speed in kph.  Returns a tuple of
+    # (speed, direction, gust, gust direction) when it's time to
+    # publish, otherwise None.
+    def add(self, ts, speed, direction):
+        with self.lock:
+            if self.window_end == 0:
+                self.window_end = ts + self.interval
+
+            self.speed = speed
+            self.direction = direction
+            if self.peak is None or speed > self.peak:
+                self.peak = speed
+                self.peak_direction = direction
+
+            if ts >= self.window_end:
+                return self.take(ts)
+        return None
+
+    # Called periodically so the last interval still gets published
+    # if the samples stop.
+    def flush(self, now):
+        with self.lock:
+            if self.peak is not None and now >= self.window_end:
+                return self.take(now)
+        return None
+
+    def take(self, now):
+        sample = (self.speed, self.direction, self.peak, self.peak_direction)
+        self.peak = None
+        self.window_end = now + self.interval
+        return sample
+
+
+class VectorWindow(object):
+    """
+        Wind samples over the last span seconds in a fixed size ring
+        buffer.  Running sums of the speed weighted east/north
+        components and of the unit direction vectors are kept as
+        samples come and go, so the vector mean speed and direction and
+        the direction variability are O(1) no matter how many samples
+        the window holds.  Calm samples count toward the speed but
+        have no direction.
+    """
+    def __init__(self, span, size):
+        self.span = span
+        self.size = size
+        self.ts = [0] * size
+        self.u = [0.0] * size
+        self.v = [0.0] * size
+        self.su = [0.0] * size
+        self.sv = [0.0] * size
+        self.directional = [0] * size
+        self.head = 0       # oldest sample
+        self.count = 0
+        self.sum_u = 0.0
+        self.sum_v = 0.0
+        self.sum_su = 0.0
+        self.sum_sv = 0.0
+        self.sum_dir = 0
+
+    def drop(self):
+        i = self.head
+        self.sum_u -= self.u[i]
+        self.sum_v -= self.v[i]
+        self.sum_su -= self.su[i]
+        self.sum_sv -= self.sv[i]
+        self.sum_dir -= self.directional[i]
+        self.head = (i + 1) % self.size
+        self.count -= 1
+        if self.count == 0:
+            # don't let rounding errors pile up
+            self.sum_u = self.sum_v = self.sum_su = self.sum_sv = 0.0
+
+    def expire(self, now):
+        while self.count and self.ts[self.head] <= now - self.span:
+            self.drop()
+
+    def add(self, ts, u, v, su, sv, directional):
+        if self.count == self.size:
+            self.drop()
+        i = (self.head + self.count) % self.size
+        self.ts[i] = ts
+        self.u[i] = u
+        self.v[i] = v
+        self.su[i] = su
+        self.sv[i] = sv
+        self.directional[i] = directional
+        self.sum_u += u
+        self.sum_v += v
+        self.sum_su += su
+        self.sum_sv += sv
+        self.sum_dir += directional
+        self.count += 1
+        self.expire(ts)
+
+    def mean(self):
+        """
+            Returns (vector mean speed, mean direction, direction
+            standard deviation) or None when the window is empty.
+            Direction is None when all the samples were calm.
+        """
+        if self.count == 0:
+            return None
+        speed = math.hypot(self.sum_u, self.sum_v) / self.count
+        if self.sum_dir == 0:
+            return (speed, None, None)
+        direction = math.degrees(math.atan2(self.sum_u, self.sum_v)) % 360
+        # Mardia's circular standard deviation from the mean resultant
+        # length of the unit vectors.
+        r = min(1.0, math.hypot(self.sum_su, self.sum_sv) / self.sum_dir)
+        spread = math.degrees(math.sqrt(-2 * math.log(r))) if r > 0 else 180.0
+        return (speed, direction, spread)
+
+
+class WindEngine(object):
+    """
+        Rolling 2 and 10 minute vector mean wind and the direction of
+        the peak speed over the last gust_span seconds.
+
+        rapid_wind samples (every 3 seconds) are used when they're
+        coming in.  The once a minute observation averages are only used
+        when there haven't been any rapid_wind samples for a while.
+
+        Directions are where the wind comes from, u/v are the east and
+        north components of that vector.
+    """
+    RAPID_TIMEOUT = 120
+
+    def __init__(self, gust_span=60):
+        self.lock = threading.Lock()
+        self.short = VectorWindow(120, 120 // 3 + 8)
+        self.long = VectorWindow(600, 600 // 3 + 8)
+        self.gust_span = gust_span
+        self.peaks = collections.deque()    # (ts, speed, direction), speed decreasing
+        self.last_rapid = 0
+
+    def add(self, ts, speed, direction, rapid=True):
+        if speed is None:
+            return
+        with self.lock:
+            if rapid:
+                self.last_rapid = ts
+            elif ts - self.last_rapid < self.RAPID_TIMEOUT:
+                return
+
+            if direction is None or speed <= 0:
+                sample = (0.0, 0.0, 0.0, 0.0, 0)
+            else:
+                rad = math.radians(direction)
+                su = math.sin(rad)
+                sv = math.cos(rad)
+                sample = (speed * su, speed * sv, su, sv, 1)
+            self.short.add(ts, *sample)
+            self.long.add(ts, *sample)
+
+            # sliding window maximum for the gust direction
+            while self.peaks and self.peaks[-1][1] <= speed:
+                self.peaks.pop()
+            self.peaks.append((ts, speed, direction))
+            while self.peaks[0][0] <= ts - self.gust_span:
+                self.peaks.popleft()
+
+    def gust_direction(self):
+        with self.lock:
+            return self.peaks[0][2] if self.peaks else None
+
+    def averages(self):
+        """
+            Returns (2 min speed, 2 min direction, 10 min speed, 10 min
+            direction, 2 min variability, 10 min variability).  Values
+            are None if there's no data for them.
+        """
+        with self.lock:
+            short = self.short.mean() or (None, None, None)
+            long = self.long.mean() or (None, None, None)
+        return (short[0], short[1], long[0], long[1], short[2], long[2])
+
+
 class WindNode(polyinterface.Node):
     id = 'wind'
     hint = [1,11,4,0]
@@ -24,37 +220,82 @@ class WindNode(polyinterface.Node):
             {'driver': 'GV0', 'value': 0, 'uom': 76}, # direction
             {'driver': 'GV1', 'value': 0, 'uom': 32}, # gust
             {'driver': 'GV2', 'value': 0, 'uom': 76}, # gust direction
-            {'driver': 'GV3', 'value': 0, 'uom': 32} # lull
+            {'driver': 'GV3', 'value': 0, 'uom': 32}, # lull
+            {'driver': 'GV4', 'value': 0, 'uom': 32}, # max gust today
+            {'driver': 'GV5', 'value': 0, 'uom': 32}, # max gust yesterday
+            {'driver': 'GV6', 'value': 0, 'uom': 32}, # 2 min average speed
+            {'driver': 'GV7', 'value': 0, 'uom': 76}, # 2 min average direction
+            {'driver': 'GV8', 'value': 0, 'uom': 32}, # 10 min average speed
+            {'driver': 'GV9', 'value': 0, 'uom': 76}, # 10 min average direction
+            {'driver': 'GV10', 'value': 0, 'uom': 76}, # 2 min direction variability
+            {'driver': 'GV11', 'value': 0, 'uom': 76}  # 10 min direction variability
             ]
+    quantities = {'ST': 'speed', 'GV0': None, 'GV1': 'speed', 'GV2': None,
+            'GV3': 'speed', 'GV4': 'speed', 'GV5': 'speed', 'GV6': 'speed',
+            'GV7': None, 'GV8': 'speed', 'GV9': None, 'GV10': None,
+            'GV11': None}
+    convert = conversion.converters(quantities, 'kph')
 
     def SetUnits(self, u):
         self.units = u
+        self.convert = conversion.converters(self.quantities, u)
         if (u == 'kph'):
             self.drivers[0]['uom'] = 32
             self.drivers[2]['uom'] = 32
             self.drivers[4]['uom'] = 32
+            self.drivers[5]['uom'] = 32
+            self.drivers[6]['uom'] = 32
+            self.drivers[7]['uom'] = 32
+            self.drivers[9]['uom'] = 32
             self.id = 'wind'
         if (u == 'ms'):
             self.drivers[0]['uom'] = 40
             self.drivers[2]['uom'] = 40
             self.drivers[4]['uom'] = 40
+            self.drivers[5]['uom'] = 40
+            self.drivers[6]['uom'] = 40
+            self.drivers[7]['uom'] = 40
+            self.drivers[9]['uom'] = 40
             self.id = 'wind'
         elif (u == 'mph'): 
             self.drivers[0]['uom'] = 48
             self.drivers[2]['uom'] = 48
             self.drivers[4]['uom'] = 48
+            self.drivers[5]['uom'] = 48
+            self.drivers[6]['uom'] = 48
+            self.drivers[7]['uom'] = 48
+            self.drivers[9]['uom'] = 48
             self.id = 'windUS'
 
     def setDriver(self, driver, value):
-        if (driver == 'ST' or driver == 'GV1' or driver == 'GV3'):
-            if (self.units == 'mph'):
-                value = round(value / 1.609344, 2)
-        super(WindNode, self).setDriver(driver, value, report=True, force=True)
-
-    def update(self, ws, wd, wg, wl):
-        self.setDriver('ST', ws)
-        self.setDriver('GV0', wd)
-        self.setDriver('GV1', wg)
-        self.setDriver('GV2', wd)
-        self.setDriver('GV3', wl)
+        self.controller.publisher.publish(self, driver, self.convert[driver](value))
+
+    def update_rapid(self, sample):
+        for (driver, value) in conversion.convert_vector(self.convert,
+                ('ST', 'GV0', 'GV1', 'GV2'), sample):
+            self.controller.publisher.publish(self, driver, value)
+
+    # gd is the gust direction, the observations don't have one so
+    # it's the average direction when there's nothing better.
+    def update(self, ws, wd, wg, wl, gd=None):
+        if gd is None:
+            gd = wd
+        for (driver, value) in conversion.convert_vector(self.convert,
+                ('ST', 'GV0', 'GV1', 'GV2', 'GV3'), (ws, wd, wg, gd, wl)):
+            self.controller.publisher.publish(self, driver, value)
+
+    # WindEngine.averages()
+    def update_averages(self, values):
+        for (driver, value) in conversion.convert_vector(self.convert,
+                ('GV6', 'GV7', 'GV8', 'GV9', 'GV10', 'GV11'), values):
+            if value is not None:
+                if driver in ('GV7', 'GV9', 'GV10', 'GV11'):
+                    value = round(value)
+                self.controller.publisher.publish(self, driver, value)
 
+    # highest gust today and yesterday from daily.DailyStats
+    def update_daily(self, values):
+        for (driver, value) in conversion.convert_vector(self.convert,
+                ('GV4', 'GV5'), (values[0], values[3])):
+            if value is not None:
+                self.controller.publisher.publish(self, driver, value)
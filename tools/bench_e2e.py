@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+End to end ingest benchmark.
+
+Runs the Controller, with the fake polyinterface, listening on a
+loopback port and drives it with the synthetic hub.  Reports
+
+  throughput - packets sent and handled per second
+  drops      - wanted packets never handled (kernel + queue drops)
+  cpu        - node server CPU time per handled packet.  The hub runs
+               in its own process so it isn't counted.
+  latency    - p50/p99/max from the datagram being read from the socket
+               to the last setDriver call made for it
+  shutdown   - how long my_stop() takes on an idle socket
+
+usage:
+    python3 tools/bench_e2e.py [--stations N] [--monitor N] [--speedup X]
+                               [--duration SEC] [--mode asyncio|thread|both]
+"""
+import time
+import argparse
+import multiprocessing
+
+import harness
+harness.setup()
+
+import synthetic_hub
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def hub_process(args, result):
+    hub = synthetic_hub.SyntheticHub(
+            synthetic_hub.stations(args.stations, args.kind),
+            port=args.port, speedup=args.speedup)
+    hub.run(args.duration)
+    result.put(hub.total_sent())
+
+
+def run(mode, args):
+    hub_stations = synthetic_hub.stations(args.stations, args.kind)
+    monitored = {st.id: st.serials() for st in hub_stations[:args.monitor]}
+
+    control = harness.controller(monitored, 'us', {
+        'ListenPort': args.port,
+        'IngestMode': mode,
+        })
+    recorder = harness.recorder()
+    recorder.clear()
+
+    handled = [0]
+    latency = []
+    udp_data = control.udp_data
+
+    # wrap the handler to time each packet up to its last driver update
+    def timed(data, received):
+        calls = recorder.count
+        udp_data(data, received)
+        if recorder.count != calls:
+            latency.append(recorder.calls[-1][0] - received)
+        handled[0] += 1
+
+    control.udp_data = timed
+    control.start_udp()
+    time.sleep(0.5)
+
+    result = multiprocessing.Queue()
+    hub = multiprocessing.Process(target=hub_process, args=(args, result))
+    cpu = time.process_time()
+    start = time.monotonic()
+    hub.start()
+    sent = result.get()
+    hub.join()
+
+    # let the worker finish what's queued
+    last = -1
+    while handled[0] != last:
+        last = handled[0]
+        time.sleep(0.5)
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - cpu
+
+    queue = control.receiver.queue.stats()
+    stop = time.monotonic()
+    control.my_stop()
+    shutdown = time.monotonic() - stop
+
+    wanted = control.packet_filter.accepted
+    return {
+            'mode': mode,
+            'sent': sent,
+            'wanted': wanted,
+            'handled': handled[0],
+            'dropped': wanted - handled[0],
+            'queue_dropped': queue['dropped'],
+            'coalesced': queue['coalesced'],
+            'sent_pps': sent / elapsed,
+            'pps': handled[0] / elapsed,
+            'cpu_us': cpu / max(1, handled[0]) * 1e6,
+            'updates': recorder.count,
+            'p50_ms': percentile(latency, 50) * 1000,
+            'p99_ms': percentile(latency, 99) * 1000,
+            'max_ms': (max(latency) if latency else 0) * 1000,
+            'shutdown_ms': shutdown * 1000,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end ingest benchmark')
+    parser.add_argument('--stations', type=int, default=4,
+            help='stations sending traffic')
+    parser.add_argument('--monitor', type=int, default=1,
+            help='how many of those the controller monitors')
+    parser.add_argument('--kind', default='mixed', choices=('mixed', 'tempest', 'airsky'))
+    parser.add_argument('--speedup', type=float, default=60)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=50422)
+    parser.add_argument('--mode', default='both', choices=('asyncio', 'thread', 'both'))
+    args = parser.parse_args()
+
+    modes = ('asyncio', 'thread') if args.mode == 'both' else (args.mode,)
+    for mode in modes:
+        r = run(mode, args)
+        print('%-8s sent %6d (%7.1f pkt/s) wanted %6d handled %6d (%7.1f pkt/s) '
+                'dropped %5d (queue %d, coalesced %d)' % (r['mode'], r['sent'],
+                    r['sent_pps'], r['wanted'], r['handled'], r['pps'],
+                    r['dropped'], r['queue_dropped'], r['coalesced']))
+        print('         cpu %7.1f us/pkt  %d driver updates  latency p50 %.3f ms '
+                'p99 %.3f ms max %.3f ms' % (r['cpu_us'], r['updates'],
+                    r['p50_ms'], r['p99_ms'], r['max_ms']))
+        print('         shutdown %.1f ms' % r['shutdown_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Insert and query speed of the local observation history
+(nodes/history.py).  Fills a fresh database with one minute obs_st
+rows, then times a day of range scans, rain totals, finding gaps and
+pruning to a size limit.
+
+usage:
+    python3 tools/bench_history.py [--days N] [--devices N] [--max-mb N]
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import harness
+harness.setup()
+
+from nodes import history
+
+
+def fill(store, serials, start, days):
+    r = random.Random(1)
+    count = 0
+    began = time.perf_counter()
+    for serial in serials:
+        ts = start
+        for day in range(days):
+            # a packet at a time, the way they arrive
+            for minute in range(1440):
+                rain = r.choice((0, 0, 0, 0, 0.1, 0.4))
+                store.add(serial, 'obs_st', [[ts, 0.2, 1.5, 2.8, r.randint(0, 359),
+                    6, 1012.4, 15.2, 60.1, 12000, 2.1, 150, rain, 0, 0, 0,
+                    2.6, 1]])
+                ts += 60
+                count += 1
+    store.flush()
+    return (count, time.perf_counter() - began)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Observation history benchmark')
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--devices', type=int, default=2)
+    parser.add_argument('--max-mb', type=float, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'history.db')
+    store = history.History(path, max_days=args.days + 10, max_mb=0)
+    serials = ['ST-%08d' % i for i in range(args.devices)]
+    start = int(time.time()) - args.days * 86400
+
+    (count, elapsed) = fill(store, serials, start, args.days)
+    print('insert      %8d rows %8.1f us/row' % (count, elapsed / count * 1e6))
+    print('size        %8.1f MB  %6.1f bytes/row' % (store.size() / 1048576.0,
+        store.size() / float(count)))
+
+    began = time.perf_counter()
+    scans = 50
+    for i in range(scans):
+        day = start + random.randint(0, args.days - 1) * 86400
+        rows = store.rows(serials[:1], day, day + 86400)
+    elapsed = time.perf_counter() - began
+    print('day scan    %8d rows %8.2f ms/scan' % (len(rows), elapsed / scans * 1000))
+
+    began = time.perf_counter()
+    total = store.rain_total(serials[:1], start, start + args.days * 86400)
+    elapsed = time.perf_counter() - began
+    print('rain total  %8.1f mm  %8.2f ms' % (total, elapsed * 1000))
+
+    end = start + args.days * 86400
+    began = time.perf_counter()
+    missing = store.gaps(serials[:1], start - 86400, end)
+    elapsed = time.perf_counter() - began
+    print('gaps        %8d found %7.2f ms, full scan' % (len(missing), elapsed * 1000))
+
+    # the next start only scans the last day
+    store.checked(serials[0], start - 86400, end - 86400)
+    began = time.perf_counter()
+    missing = store.gaps(serials[:1], start - 86400, end)
+    elapsed = time.perf_counter() - began
+    print('gaps        %8d found %7.2f ms, after a check' % (len(missing), elapsed * 1000))
+
+    store.max_mb = args.max_mb
+    began = time.perf_counter()
+    store.prune()
+    elapsed = time.perf_counter() - began
+    print('prune to %.0f MB  %d rows dropped  %.1f ms, %.1f MB in use, file %.1f MB' % (
+        args.max_mb, store.pruned, elapsed * 1000, store.size() / 1048576.0,
+        os.path.getsize(path) / 1048576.0))
+
+    store.close()
+    for name in os.listdir(tmp):
+        os.remove(os.path.join(tmp, name))
+    os.rmdir(tmp)
+
+
+if __name__ == '__main__':
+    main()
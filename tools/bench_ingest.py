@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Compare the asyncio and thread UDP ingest engines.
+
+Sends a burst of obs_st packets over loopback to each receiver and
+reports packets/s handled, packets dropped and the p50/p99 latency from
+the datagram being sent to the handler being called.  The handler
+sleeps for --publish seconds per packet to stand in for the setDriver
+fan-out done by the node server.
+
+usage:
+    python3 tools/bench_ingest.py [--count N] [--rate PPS] [--publish SEC]
+"""
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+
+import harness
+harness.setup()
+
+from nodes import ingest
+
+
+def packet(seq):
+    return json.dumps({
+        'serial_number': 'ST-00000512',
+        'type': 'obs_st',
+        'hub_sn': 'HB-00013030',
+        'obs': [[1588948614 + seq, 0.18, 0.22, 0.27, 144, 6, 1017.57, 22.37,
+            50.26, 328, 0.03, 3, 0.000000, 0, 0, 0, 2.410, 1]],
+        'firmware_revision': 129,
+        'seq': seq,
+        'sent': time.monotonic(),
+        }).encode('utf-8')
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def run(mode, port, count, rate, publish):
+    latency = []
+    done = [0]
+
+    def handler(data, received):
+        if 'sent' not in data:
+            return
+        latency.append(time.monotonic() - data['sent'])
+        if publish:
+            time.sleep(publish)
+        done[0] = time.monotonic()
+
+    receiver = ingest.create(mode, port, handler)
+    receiver.start()
+    time.sleep(0.5)
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    interval = 1.0 / rate if rate else 0
+    start = time.monotonic()
+    for seq in range(count):
+        s.sendto(packet(seq), ('127.0.0.1', port))
+        if interval:
+            next_send = start + (seq + 1) * interval
+            while time.monotonic() < next_send:
+                pass
+
+    # wait for the handler to go idle
+    last = -1
+    while len(latency) != last:
+        last = len(latency)
+        time.sleep(0.5 + publish * 10)
+    elapsed = done[0] - start
+
+    receiver.stop()
+    # the thread receiver only sees the stop flag on the next datagram
+    s.sendto(b'{}', ('127.0.0.1', port))
+    receiver.join(5)
+    s.close()
+
+    handled = len(latency)
+    return {
+            'mode': mode,
+            'handled': handled,
+            'dropped': count - handled,
+            'pps': handled / elapsed,
+            'p50_ms': percentile(latency, 50) * 1000,
+            'p99_ms': percentile(latency, 99) * 1000,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UDP ingest benchmark')
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=0,
+            help='packets per second to send, 0 for as fast as possible')
+    parser.add_argument('--publish', type=float, default=0.0,
+            help='simulated publish time per packet in seconds')
+    parser.add_argument('--port', type=int, default=50322)
+    args = parser.parse_args()
+
+    for mode in ingest.MODES:
+        r = run(mode, args.port, args.count, args.rate, args.publish)
+        print('%-8s handled %6d dropped %6d  %9.0f pkt/s  p50 %8.3f ms  p99 %8.3f ms' %
+                (r['mode'], r['handled'], r['dropped'], r['pps'],
+                    r['p50_ms'], r['p99_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Measure the byte level packet pre-filter against decoding every packet.
+
+Builds one minute of broadcast traffic for --stations Tempest stations
+(obs_st, rapid_wind every 3 seconds, device_status and hub_status) of
+which only the first is wanted, then times
+
+  decode  - json.loads() every packet then check serial_number/type
+  filter  - PacketFilter.classify() every packet, json.loads() the rest
+
+usage:
+    python3 tools/bench_prefilter.py [--stations N] [--repeat N]
+"""
+import os
+import sys
+import time
+import json
+import random
+import argparse
+
+import harness
+harness.setup()
+
+from nodes import ingest
+
+
+def station_minute(n, ts):
+    sn = 'ST-%08d' % (1000 + n)
+    hub = 'HB-%08d' % (1000 + n)
+    packets = [{
+        'serial_number': sn, 'type': 'obs_st', 'hub_sn': hub,
+        'obs': [[ts, 0.18, 0.22, 0.27, 144, 6, 1017.57, 22.37, 50.26, 328,
+            0.03, 3, 0.0, 0, 0, 0, 2.410, 1]],
+        'firmware_revision': 129}, {
+        'serial_number': sn, 'type': 'device_status', 'hub_sn': hub,
+        'timestamp': ts, 'uptime': 2189, 'voltage': 3.50, 'rssi': -17,
+        'hub_rssi': -87, 'sensor_status': 0, 'debug': 0,
+        'firmware_revision': 129}]
+    for i in range(20):
+        packets.append({'serial_number': sn, 'type': 'rapid_wind',
+            'hub_sn': hub, 'ob': [ts + i * 3, 2.3, 128]})
+    for i in range(6):
+        packets.append({'serial_number': hub, 'type': 'hub_status',
+            'firmware_revision': '35', 'uptime': 1670133, 'rssi': -62,
+            'timestamp': ts + i * 10, 'reset_flags': 'BOR,PIN,POR',
+            'seq': 48, 'radio_stats': [2, 1, 0, 3, 2839]})
+    return packets
+
+
+def traffic(stations):
+    ts = 1588948614
+    packets = []
+    for n in range(stations):
+        packets.extend(station_minute(n, ts))
+    random.Random(1).shuffle(packets)
+    return [json.dumps(p).encode('utf-8') for p in packets]
+
+
+def decode_all(packets, wanted):
+    kept = 0
+    for raw in packets:
+        data = json.loads(raw.decode('utf-8'))
+        if data['serial_number'] not in wanted:
+            continue
+        if data['type'] not in ingest.HANDLED_TYPES:
+            continue
+        kept += 1
+    return kept
+
+
+def prefilter(packets, packet_filter):
+    kept = 0
+    for raw in packets:
+        if packet_filter.classify(raw) is None:
+            continue
+        json.loads(raw.decode('utf-8'))
+        kept += 1
+    return kept
+
+
+def best(func, args, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        kept = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Packet pre-filter benchmark')
+    parser.add_argument('--stations', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    packets = traffic(args.stations)
+    wanted = ['ST-%08d' % 1000, 'HB-%08d' % 1000]
+    packet_filter = ingest.PacketFilter(wanted)
+
+    (d_time, d_kept) = best(decode_all, (packets, wanted), args.repeat)
+    (f_time, f_kept) = best(prefilter, (packets, packet_filter), args.repeat)
+
+    print('%d packets from %d stations, %d wanted' %
+            (len(packets), args.stations, d_kept))
+    print('decode  %7.3f us/pkt' % (d_time / len(packets) * 1e6))
+    print('filter  %7.3f us/pkt  (%d kept, %.1fx faster)' %
+            (f_time / len(packets) * 1e6, f_kept, d_time / f_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Accuracy and throughput of the derived temperature metrics engine
+(nodes/psychrometrics.py) against the per value TemperatureNode
+functions it replaced.
+
+Accuracy: feels like, dew point, heat index and wind chill are compared
+over a grid of temperature, humidity and wind speed.  Wet-bulb is
+compared against an iterative psychrometric solution and air density
+against the ideal gas law with a separate vapor pressure formula.
+
+Throughput: the old functions (four calls per observation), derive()
+and derive_array() (when NumPy is installed).
+
+usage:
+    python3 tools/bench_psychro.py [--count N]
+"""
+import math
+import time
+import random
+import argparse
+
+import harness
+harness.setup()
+
+from nodes import psychrometrics
+
+
+# The TemperatureNode functions as they were.  ApparentTemp wants wind
+# in m/s, Windchill in kph.
+def Dewpoint(t, h):
+    b = (17.625 * t) / (243.04 + t)
+    rh = h / 100.0
+    if rh <= 0:
+        return 0
+    c = math.log(rh)
+    dewpt = (243.04 * (c + b)) / (17.625 - c - b)
+    return round(dewpt, 1)
+
+
+def ApparentTemp(t, ws, h):
+    wv = h / 100.0 * 6.105 * math.exp(17.27 * t / (237.7 + t))
+    at = t + (0.33 * wv) - (0.70 * ws) - 4.0
+    return round(at, 1)
+
+
+def Windchill(t, ws):
+    tf = (t * 1.8) + 32
+    mph = ws / 1.609
+    wc = 35.74 + (0.6215 * tf) - (35.75 * math.pow(mph, 0.16)) + (0.4275 * tf * math.pow(mph, 0.16))
+    if (tf <= 50.0) and (mph >= 5.0):
+        return round((wc - 32) / 1.8, 1)
+    else:
+        return t
+
+
+def Heatindex(t, h):
+    tf = (t * 1.8) + 32
+    c1 = -42.379
+    c2 = 2.04901523
+    c3 = 10.1433127
+    c4 = -0.22475541
+    c5 = -6.83783 * math.pow(10, -3)
+    c6 = -5.481717 * math.pow(10, -2)
+    c7 = 1.22874 * math.pow(10, -3)
+    c8 = 8.5282 * math.pow(10, -4)
+    c9 = -1.99 * math.pow(10, -6)
+    hi = (c1 + (c2 * tf) + (c3 * h) + (c4 * tf * h) + (c5 * tf *tf) + (c6 * h * h) + (c7 * tf * tf * h) + (c8 * tf * h * h) + (c9 * tf * tf * h * h))
+    if (tf < 80.0) or (h < 40.0):
+        return t
+    else:
+        return round((hi - 32) / 1.8, 1)
+
+
+def old(t, h, ws):
+    return (ApparentTemp(t, ws / 3.6, h), Dewpoint(t, h), Heatindex(t, h),
+            Windchill(t, ws))
+
+
+def saturation(t):
+    # Buck (1981), mb
+    return 6.1121 * math.exp((18.678 - t / 234.5) * (t / (257.14 + t)))
+
+
+def wetbulb(t, h, p):
+    # solve the psychrometer equation by bisection
+    e = h / 100.0 * saturation(t)
+    lo = -60.0
+    hi = t
+    for i in range(60):
+        tw = (lo + hi) / 2
+        if saturation(tw) - 0.00066 * (1 + 0.00115 * tw) * p * (t - tw) > e:
+            hi = tw
+        else:
+            lo = tw
+    return tw
+
+
+def density(t, h, p):
+    e = h / 100.0 * saturation(t)
+    tk = t + 273.15
+    return (p - e) * 100 / (287.058 * tk) + e * 100 / (461.495 * tk)
+
+
+def grid():
+    for t in range(-30, 46):
+        for h in range(5, 101, 5):
+            for ws in (0, 5, 10, 20, 40, 80):
+                yield (t + 0.37, float(h), float(ws), 1013.25)
+
+
+def accuracy():
+    names = ('feels like', 'dew point', 'heat index', 'wind chill')
+    worst = [0.0] * 4
+    mismatched = [0] * 4
+    wb_err = []
+    ad_err = []
+    count = 0
+    for (t, h, ws, p) in grid():
+        count += 1
+        new = psychrometrics.derive(t, h, ws, p)
+        ref = old(t, h, ws)
+        for i in range(4):
+            d = abs(new[i] - ref[i])
+            if d > 1e-9:
+                mismatched[i] += 1
+            worst[i] = max(worst[i], d)
+        # Stull's fit is only claimed for 5 - 99% and -20 - 50C
+        if t >= -20 and h <= 99:
+            wb_err.append(abs(new[4] - wetbulb(t, h, p)))
+        ad_err.append(abs(new[5] - density(t, h, p)))
+
+    print('accuracy over %d observations' % count)
+    for i in range(4):
+        print('  %-11s max diff %.3f, %d differ from the old function' %
+                (names[i], worst[i], mismatched[i]))
+    # Stull is worst when it's both cold and dry
+    print('  %-11s mean err %.3f C, max %.3f C, %.1f%% within 1 C of the psychrometric solution' %
+            ('wet-bulb', sum(wb_err) / len(wb_err), max(wb_err),
+                100.0 * sum(1 for e in wb_err if e <= 1.0) / len(wb_err)))
+    print('  %-11s max err %.4f kg/m3 vs ideal gas with Buck vapor pressure' %
+            ('air density', max(ad_err)))
+
+
+def throughput(count):
+    r = random.Random(1)
+    t = [r.uniform(-20, 40) for i in range(count)]
+    h = [r.uniform(5, 100) for i in range(count)]
+    ws = [r.uniform(0, 60) for i in range(count)]
+    p = [r.uniform(980, 1040) for i in range(count)]
+
+    start = time.perf_counter()
+    for i in range(count):
+        old(t[i], h[i], ws[i])
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(count):
+        psychrometrics.derive(t[i], h[i], ws[i], p[i])
+    new_time = time.perf_counter() - start
+
+    print('throughput, %d observations' % count)
+    print('  old functions  %7.3f us/obs (4 metrics)' % (old_time / count * 1e6))
+    print('  derive()       %7.3f us/obs (6 metrics, %.1fx)' %
+            (new_time / count * 1e6, old_time / new_time))
+
+    if psychrometrics.numpy is None:
+        print('  derive_array() skipped, NumPy is not installed')
+        return
+
+    start = time.perf_counter()
+    arrays = psychrometrics.derive_array(t, h, ws, p)
+    array_time = time.perf_counter() - start
+    print('  derive_array() %7.3f us/obs (6 metrics, %.1fx)' %
+            (array_time / count * 1e6, old_time / array_time))
+
+    # the two paths should agree
+    diff = 0.0
+    for i in range(count):
+        scalar = psychrometrics.derive(t[i], h[i], ws[i], p[i])
+        for k in range(6):
+            diff = max(diff, abs(scalar[k] - float(arrays[k][i])))
+    print('  derive_array() vs derive() max diff %.3f' % diff)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Derived metrics benchmark')
+    parser.add_argument('--count', type=int, default=200000)
+    args = parser.parse_args()
+
+    accuracy()
+    throughput(args.count)
+
+
+if __name__ == '__main__':
+    main()
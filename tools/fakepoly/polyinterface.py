@@ -0,0 +1,128 @@
+"""
+Minimal stand-in for polyinterface used by the offline tools.
+
+Only the parts of the interface the node server uses are provided.
+Nothing is sent anywhere; every setDriver, reportCmd and saveCustomData
+call is appended to RECORDER so a run can be diffed or counted.
+
+usage:
+    sys.path.insert(0, 'tools/fakepoly')
+    import polyinterface
+"""
+import time
+import logging
+import threading
+
+LOGGER = logging.getLogger('polyinterface')
+
+
+class Recorder(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.calls = []
+        self.count = 0
+
+    def record(self, kind, address, *args):
+        with self.lock:
+            self.count += 1
+            if self.enabled:
+                self.calls.append((time.monotonic(), kind, address) + args)
+
+    def clear(self):
+        with self.lock:
+            self.calls = []
+            self.count = 0
+
+
+RECORDER = Recorder()
+
+
+class Node(object):
+    id = ''
+    hint = [0, 0, 0, 0]
+    drivers = []
+    commands = {}
+
+    def __init__(self, controller, primary, address, name):
+        self.controller = controller
+        self.parent = controller
+        self.primary = primary
+        self.address = address
+        self.name = name
+        self.polyConfig = None
+        self.added = False
+        self.drivers = [dict(d) for d in self.drivers]
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        for d in self.drivers:
+            if d['driver'] == driver:
+                d['value'] = value
+                if uom is not None:
+                    d['uom'] = uom
+        if report:
+            RECORDER.record('setDriver', self.address, driver, value)
+
+    def getDriver(self, driver):
+        for d in self.drivers:
+            if d['driver'] == driver:
+                return d['value']
+        return None
+
+    def reportDrivers(self):
+        for d in self.drivers:
+            RECORDER.record('setDriver', self.address, d['driver'], d['value'])
+
+    def reportCmd(self, command, value=None, uom=None):
+        RECORDER.record('reportCmd', self.address, command, value)
+
+
+class Controller(Node):
+    def __init__(self, poly):
+        super(Controller, self).__init__(self, 'controller', 'controller', 'Controller')
+        self.poly = poly
+        self.nodes = {}
+        self.polyConfig = {'customParams': {}, 'customData': {}}
+        self.configured = False
+
+    def addNode(self, node, update=False):
+        self.nodes[node.address] = node
+        node.added = True
+        return node
+
+    def delNode(self, address):
+        self.nodes.pop(address, None)
+
+    def addNotice(self, data, key=None):
+        LOGGER.info('notice: ' + str(data))
+
+    def removeNoticesAll(self):
+        pass
+
+    def addCustomParam(self, data):
+        self.polyConfig['customParams'].update(data)
+
+    def runForever(self):
+        pass
+
+
+class Interface(object):
+    def __init__(self, name=None):
+        self.name = name
+        self.custom_data = {}
+
+    def start(self):
+        pass
+
+    def onConfig(self, callback):
+        pass
+
+    def onStop(self, callback):
+        pass
+
+    def saveCustomData(self, data):
+        RECORDER.record('saveCustomData', '', len(str(data)))
+        self.custom_data = data
+
+    def installprofile(self):
+        pass
@@ -0,0 +1,66 @@
+"""
+Helpers for running the node server offline from the tools in this
+directory.  The fake polyinterface in tools/fakepoly is always used so
+nothing is sent to Polyglot and every driver update is recorded.
+
+usage:
+    import harness
+    harness.setup()
+    control = harness.controller({'1234': ['ST-00000512', 'HB-00013030']})
+"""
+import os
+import sys
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TOOLS)
+
+
+def setup():
+    for path in (ROOT, os.path.join(TOOLS, 'fakepoly')):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+
+
+def recorder():
+    import polyinterface
+    return polyinterface.RECORDER
+
+
+def controller(stations, units='metric', params=None):
+    """
+        Build a Controller with nodes for the given stations without
+        talking to the WeatherFlow servers.  stations is a dictionary of
+        station ID -> list of device serial numbers.
+    """
+    import polyinterface
+    from nodes import weatherflow
+
+    control = weatherflow.Controller(polyinterface.Interface('WeatherFlow'))
+    # no rain journal in the current directory
+    control.persist.journal = None
+    ids = list(stations.keys())
+    control.params.set('Station', ','.join(ids))
+    control.params.set('Units', units)
+    if params is not None:
+        for name in params:
+            control.params.set(name, params[name])
+    control.check_params()
+
+    # keep the first station from looking like a station change
+    control.rain_data['station'] = ids[0]
+
+    def query_wf(station):
+        for sn in stations[station.id]:
+            station.add_device(sn)
+            if sn.startswith('ST'):
+                station.tempest_sn = sn
+                station.tempest = True
+            elif sn.startswith('AR'):
+                station.air_sn = sn
+            elif sn.startswith('SK'):
+                station.sky_sn = sn
+
+    control.query_wf = query_wf
+    control.discover()
+    return control
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Replay a UDP capture (see the CaptureFile parameter) through the node
+server's packet handling without Polyglot or a network.
+
+Each captured datagram goes through the same packet filter, decode and
+Controller.udp_data() path as live data.  Driver updates are recorded by
+the fake polyinterface and can be written out with --output so two runs
+can be diffed.
+
+usage:
+    python3 tools/replay.py capture.wfcap
+    python3 tools/replay.py capture.wfcap --realtime
+    python3 tools/replay.py capture.wfcap --station 1234:ST-00000512,HB-00013030
+    python3 tools/replay.py capture.wfcap --output calls.txt
+    python3 tools/replay.py capture.wfcap --metrics
+"""
+import os
+import sys
+import time
+import argparse
+
+import harness
+harness.setup()
+
+from nodes import capture
+from nodes import ingest
+from nodes import metrics
+
+
+def parse_stations(args, path):
+    stations = {}
+    for spec in args:
+        (sid, serials) = spec.split(':', 1)
+        stations[sid] = [s for s in serials.split(',') if s != '']
+
+    if stations == {}:
+        # one station with every device seen in the capture
+        serials = []
+        for (ts, raw) in capture.read(path):
+            sn = ingest.field(raw, b'serial_number')
+            if sn is not None and sn.decode('utf-8') not in serials:
+                serials.append(sn.decode('utf-8'))
+        stations['replay'] = serials
+
+    return stations
+
+
+def replay(control, path, realtime=False):
+    packets = 0
+    handled = 0
+    first = None
+    start = time.monotonic()
+
+    for (ts, raw) in capture.read(path):
+        packets += 1
+        if realtime:
+            if first is None:
+                first = ts
+            delay = (ts - first) - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        if control.packet_filter.classify(raw) is None:
+            continue
+        m = control.metrics
+        t = m.start()
+        try:
+            data = ingest.decode(raw)
+        except:
+            continue
+        m.stop(metrics.DECODE, t)
+
+        t = m.start()
+        try:
+            control.udp_data(data, time.monotonic())
+        except Exception as e:
+            print('Failed to process packet: ' + str(e))
+        m.stop(metrics.DISPATCH, t)
+        m.commit(data.get('type'))
+        handled += 1
+
+    return (packets, handled, time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a WeatherFlow UDP capture')
+    parser.add_argument('capture')
+    parser.add_argument('--station', action='append', default=[],
+            help='station ID:serial,serial,... (may be repeated)')
+    parser.add_argument('--units', default='metric')
+    parser.add_argument('--realtime', action='store_true',
+            help='replay at the captured speed instead of as fast as possible')
+    parser.add_argument('--output', help='write the recorded driver updates here')
+    parser.add_argument('--metrics', action='store_true',
+            help='print per stage timing')
+    args = parser.parse_args()
+
+    stations = parse_stations(args.station, args.capture)
+    control = harness.controller(stations, args.units)
+    control.metrics.enabled = args.metrics
+    recorder = harness.recorder()
+    recorder.clear()
+
+    (packets, handled, elapsed) = replay(control, args.capture, args.realtime)
+
+    updates = [c for c in recorder.calls if c[1] == 'setDriver']
+    print('%d packets, %d handled in %.3f s (%.1f us/packet), %d driver updates' %
+            (packets, handled, elapsed,
+                elapsed / packets * 1e6 if packets else 0, len(updates)))
+
+    d = control.publisher.stats()
+    print('%.1f driver updates per packet staged, %.1f sent (%d suppressed)' %
+            (d['staged_per_batch'], d['sent_per_batch'], d['suppressed']))
+
+    if args.metrics:
+        for line in control.metrics.dump():
+            print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            for c in recorder.calls:
+                f.write(' '.join(str(v) for v in c[1:]) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Synthetic WeatherFlow hub.  Sends realistic obs_st, obs_air, obs_sky,
+rapid_wind, device_status and hub_status broadcasts to a UDP port.
+
+Each simulated station is either a Tempest or an Air/Sky pair behind its
+own hub.  Time can be sped up so a minute of station traffic is sent in
+a fraction of a second.
+
+usage:
+    python3 tools/synthetic_hub.py --stations 3 --speedup 20 --duration 60
+
+    hub = SyntheticHub([SyntheticStation(0), SyntheticStation(1, 'airsky')],
+            port=50222, speedup=20)
+    hub.run(10)
+"""
+import time
+import json
+import random
+import socket
+import argparse
+
+# Default broadcast intervals, in seconds, for each packet type.
+INTERVALS = {
+        'obs': 60,
+        'rapid_wind': 3,
+        'device_status': 60,
+        'hub_status': 10,
+        }
+
+
+class SyntheticStation(object):
+    def __init__(self, n, kind='tempest', seed=None):
+        self.id = str(1000 + n)
+        self.kind = kind
+        self.hub = 'HB-%08d' % (1000 + n)
+        if kind == 'tempest':
+            self.devices = ['ST-%08d' % (1000 + n)]
+        else:
+            self.devices = ['AR-%08d' % (1000 + n), 'SK-%08d' % (1000 + n)]
+        self.random = random.Random(n if seed is None else seed)
+
+        self.temp = 15 + self.random.random() * 10
+        self.humidity = 40 + self.random.random() * 40
+        self.pressure = 1000 + self.random.random() * 25
+        self.wind = self.random.random() * 5
+        self.direction = self.random.randint(0, 359)
+
+    def serials(self):
+        return self.devices + [self.hub]
+
+    def walk(self):
+        r = self.random
+        self.temp += r.uniform(-0.1, 0.1)
+        self.humidity = min(100, max(5, self.humidity + r.uniform(-0.5, 0.5)))
+        self.pressure += r.uniform(-0.05, 0.05)
+        self.wind = max(0, self.wind + r.uniform(-0.5, 0.5))
+        self.direction = (self.direction + r.randint(-15, 15)) % 360
+
+    def obs(self, ts):
+        self.walk()
+        r = self.random
+        rain = 0.0 if r.random() < 0.9 else round(r.random() * 0.3, 3)
+        lull = round(self.wind * 0.5, 2)
+        gust = round(self.wind * 1.5, 2)
+        packets = []
+        if self.kind == 'tempest':
+            packets.append({
+                'serial_number': self.devices[0], 'type': 'obs_st',
+                'hub_sn': self.hub,
+                'obs': [[ts, lull, round(self.wind, 2), gust,
+                    self.direction, 3, round(self.pressure, 2),
+                    round(self.temp, 2), round(self.humidity, 2),
+                    r.randint(0, 80000), round(r.random() * 8, 2),
+                    r.randint(0, 900), rain, 0, 0, 0, 2.41, 1]],
+                'firmware_revision': 129})
+        else:
+            packets.append({
+                'serial_number': self.devices[0], 'type': 'obs_air',
+                'hub_sn': self.hub,
+                'obs': [[ts, round(self.pressure, 2), round(self.temp, 2),
+                    round(self.humidity, 2), 0, 0, 3.46, 1]],
+                'firmware_revision': 17})
+            packets.append({
+                'serial_number': self.devices[1], 'type': 'obs_sky',
+                'hub_sn': self.hub,
+                'obs': [[ts, r.randint(0, 80000), round(r.random() * 8, 2),
+                    rain, lull, round(self.wind, 2), gust, self.direction,
+                    3.12, 1, r.randint(0, 900), None, 0, 3]],
+                'firmware_revision': 29})
+        return packets
+
+    def rapid_wind(self, ts):
+        self.wind = max(0, self.wind + self.random.uniform(-0.3, 0.3))
+        return [{'serial_number': self.devices[-1], 'type': 'rapid_wind',
+            'hub_sn': self.hub,
+            'ob': [ts, round(self.wind, 2), self.direction]}]
+
+    def device_status(self, ts):
+        return [{'serial_number': sn, 'type': 'device_status',
+            'hub_sn': self.hub, 'timestamp': ts, 'uptime': 2189,
+            'voltage': 3.50, 'firmware_revision': 17,
+            'rssi': -self.random.randint(10, 90), 'hub_rssi': -87,
+            'sensor_status': 0, 'debug': 0} for sn in self.devices]
+
+    def hub_status(self, ts):
+        return [{'serial_number': self.hub, 'type': 'hub_status',
+            'firmware_revision': '35', 'uptime': 1670133,
+            'rssi': -62, 'timestamp': ts, 'reset_flags': 'BOR,PIN,POR',
+            'seq': 48, 'fs': [1, 0, 15675411, 524288],
+            'radio_stats': [2, 1, 0, 3, 2839], 'mqtt_stats': [1, 0]}]
+
+
+class SyntheticHub(object):
+    def __init__(self, stations, host='127.0.0.1', port=50222, speedup=1.0,
+            intervals=None):
+        self.stations = stations
+        self.address = (host, port)
+        self.speedup = speedup
+        self.intervals = dict(INTERVALS)
+        if intervals is not None:
+            self.intervals.update(intervals)
+        self.sent = {}
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, packets):
+        for p in packets:
+            self.socket.sendto(json.dumps(p).encode('utf-8'), self.address)
+            self.sent[p['type']] = self.sent.get(p['type'], 0) + 1
+
+    def total_sent(self):
+        return sum(self.sent.values())
+
+    def run(self, duration, start_ts=None):
+        """
+            Send traffic for duration (real) seconds.  Station time
+            runs speedup times faster than real time.
+        """
+        if start_ts is None:
+            start_ts = int(time.time())
+
+        # next due station time for each (station, packet type)
+        schedule = []
+        for st in self.stations:
+            for ptype in ('obs', 'rapid_wind', 'device_status', 'hub_status'):
+                if self.intervals[ptype] > 0:
+                    offset = st.random.random() * self.intervals[ptype]
+                    schedule.append([start_ts + offset, st, ptype])
+
+        start = time.monotonic()
+        while True:
+            elapsed = time.monotonic() - start
+            if elapsed >= duration:
+                break
+            now_ts = start_ts + elapsed * self.speedup
+
+            due = min(schedule, key=lambda e: e[0])
+            if due[0] > now_ts:
+                time.sleep(min(0.01, (due[0] - now_ts) / self.speedup))
+                continue
+
+            ts = int(due[0])
+            self.send(getattr(due[1], due[2])(ts))
+            due[0] += self.intervals[due[2]]
+
+
+def stations(count, kind='mixed'):
+    result = []
+    for n in range(count):
+        if kind == 'mixed':
+            result.append(SyntheticStation(n, 'tempest' if n % 2 == 0 else 'airsky'))
+        else:
+            result.append(SyntheticStation(n, kind))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic WeatherFlow hub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=50222)
+    parser.add_argument('--stations', type=int, default=1)
+    parser.add_argument('--kind', default='mixed', choices=('mixed', 'tempest', 'airsky'))
+    parser.add_argument('--speedup', type=float, default=1.0)
+    parser.add_argument('--duration', type=float, default=60)
+    for ptype in INTERVALS:
+        parser.add_argument('--' + ptype.replace('_', '-'), type=float,
+                default=INTERVALS[ptype], dest=ptype,
+                help='seconds between %s packets (0 disables)' % ptype)
+    args = parser.parse_args()
+
+    hub = SyntheticHub(stations(args.stations, args.kind), args.host,
+            args.port, args.speedup,
+            {p: getattr(args, p) for p in INTERVALS})
+    for st in hub.stations:
+        print('station %s: %s' % (st.id, ', '.join(st.serials())))
+    hub.run(args.duration)
+    print('sent %d packets: %s' % (hub.total_sent(), hub.sent))
+
+
+if __name__ == '__main__':
+    main()